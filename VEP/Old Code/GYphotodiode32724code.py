@@ -15,21 +15,24 @@ raw = mne.io.read_raw_brainvision(file_vhdr)
 baseline_tmin, baseline_tmax = -0.05, 0
 baseline = (baseline_tmin, baseline_tmax)
 
+# Only channel 0 (the photodiode) is needed, so read it once
+photodiode_data = raw.get_data(picks=[0])[0]
+
 tmin, tmax = -0.25, 0.25
-time_inds = np.where((raw.times >= tmin) & (raw.times <= tmax))[0]
+time_inds = slice(np.searchsorted(raw.times, tmin), np.searchsorted(raw.times, tmax, side='right'))
 
-peak_amp = raw.get_data()[0, time_inds].max()
-peak_time = raw.times[time_inds][raw.get_data()[0, time_inds].argmax()]
+peak_amp = photodiode_data[time_inds].max()
+peak_time = raw.times[time_inds][photodiode_data[time_inds].argmax()]
 
 print("Peak amplitude: ", peak_amp)
 print("Peak time: ", peak_time)
 
 # Find the time indices corresponding to the time window of interest
 tmin, tmax = 0.0, 0.5
-time_inds = np.where((raw.times >= tmin) & (raw.times <= tmax))[0]
+time_inds = slice(np.searchsorted(raw.times, tmin), np.searchsorted(raw.times, tmax, side='right'))
 
 # Find the peaks in the data
-peaks, peak_times = mne.preprocessing.peak_finder(raw.get_data()[0], extrema=1)
+peaks, peak_times = mne.preprocessing.peak_finder(photodiode_data, extrema=1)
 
 # Find the average latencies across all peaks in the data
 peak_latencies = peak_times - raw.times[time_inds][0]
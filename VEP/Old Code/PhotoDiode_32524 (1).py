@@ -4,6 +4,11 @@ from mne.preprocessing import (ICA) # independent component analysis
 from autoreject import AutoReject # for automatic artifact rejection 
 import matplotlib # data visualization 
 matplotlib.use("TkAgg") # backend for matplotlib to TkAgg
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from components import measure_components # batched peak/trough measurement 
 
 eeg_path = "C://Users//neuro//Documents//Python Scripts//VEP//VEP Data"  # You will need to change this location # define path 
 file_name = "AJK-03-01-24" # file name of eeg data 
@@ -91,33 +96,18 @@ baseline = (baseline_tmin, baseline_tmax) # define baseline window as a tuple
 VEP = epochs_final['Stimulus/s1'].apply_baseline(baseline).average() # extract and average epochs for first stimulus condition to create a vep 
 
 ################### new as of 3/25/24 for code to find peak amplitude of the VEP waveform within the time window after the line that defines the baseline window 
-# Find the time indices corresponding to the time window of interest
-
-tmin, tmax = 0.08, 0.12 # how long is the stimulus? When does it blink? 
-time_inds = np.where((VEP.times >= tmin) & (VEP.times <= tmax))[0] #for defining time ranges 
-
-# Find the peak amplitude and time of the VEP waveform within the time window
-peak_amp = VEP.data[0, time_inds].max() # find the max 
-peak_time = VEP.times[time_inds][VEP.data[0, time_inds].argmax()] 
+# Peak and trough of every channel in the window of interest, measured in one pass
+vep_windows = {'P100': (0.08, 0.12)} # how long is the stimulus? When does it blink? 
+components_table = measure_components({'Stimulus/s1': VEP}, windows=vep_windows)
+first_channel = components_table[components_table['channel'] == VEP.ch_names[0]][0]
 
 # Print the peak amplitude and time
-print("Peak amplitude: ", peak_amp)
-print("Peak time: ", peak_time)
-
-# Find the time indices corresponding to the time window of interest
-tmin, tmax = 0.08, 0.12
-time_inds = np.where((VEP.times >= tmin) & (VEP.times <= tmax))[0]
-
-# Find the indices and values of the lowest amplitudes in the time window
-low_amp_inds = np.where(VEP.data[0, time_inds] == VEP.data[0, time_inds].min())[0]
-low_amp_vals = VEP.data[0, time_inds][low_amp_inds]
-
-# Find the times corresponding to the lowest amplitudes- where the goal of finding the lowest amplitudes is to find the difference between flashing screen and not 
-low_amp_times = VEP.times[time_inds][low_amp_inds]
+print("Peak amplitude: ", first_channel['peak_amp'])
+print("Peak time: ", first_channel['peak_latency'])
 
-# Print the lowest amplitude values and times
-print("Lowest amplitude values: ", low_amp_vals)
-print("Times of lowest amplitudes: ", low_amp_times)
+# Print the lowest amplitude value and time- where the goal of finding the lowest amplitudes is to find the difference between flashing screen and not 
+print("Lowest amplitude values: ", first_channel['trough_amp'])
+print("Times of lowest amplitudes: ", first_channel['trough_latency'])
 
 #############################
 
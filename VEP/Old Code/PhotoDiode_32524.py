@@ -1,10 +1,15 @@
 import mne
 import numpy as np
-from mne.preprocessing import (ICA)
-from autoreject import AutoReject
+import os
+import sys
 import matplotlib
 matplotlib.use("TkAgg")
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cleaning import fit_autoreject, fit_ica, ptp_prescreen
+from filtering import filter_raw
+from roi import DEFAULT_ROIS, combine_rois, export_figures, save_rois
+
 eeg_path = "C://Users//neuro//Documents//Python Scripts//VEP//VEP Data"  # You will need to change this location
 file_name = "AJK-03-01-24"
 file_eeg = eeg_path + file_name + ".eeg"
@@ -22,7 +27,8 @@ highpass = 1
 lowpass = 20
 notch = 60
 
-raw_filtered = raw.load_data().filter(highpass, lowpass).notch_filter(np.arange(notch, (notch * 3), notch))
+# Band-pass and notch in one pass with a fused kernel, designed once per sfreq/settings
+raw_filtered = filter_raw(raw.load_data(), highpass, lowpass, np.arange(notch, (notch * 3), notch))
 #raw_filtered = raw.resample(resample).filter(highpass, lowpass).notch_filter(np.arange(notch, (notch * 3), notch))
 
 eeg_1020 = raw_filtered.copy().set_eeg_reference(ref_channels = 'average') # ref_channels='['Fz']'
@@ -44,25 +50,31 @@ epochs = mne.Epochs(eeg_1020,
                     detrend=None,
                     event_repeated='drop')
 
+# Drop gross artifacts cheaply, then run AutoReject on all cores.
+# The fit is cached per file, so reruns on the same epochs skip the search
+epochs = ptp_prescreen(epochs, picks, max_ptp=500e-6)
 n_interpolates = np.array([1, 4, 32])
 consensus_percs = np.linspace(0, 1.0, 11)
-ar = AutoReject(n_interpolates,
-                consensus_percs,
-                picks=picks,
-                thresh_method='random_search',
-                random_state=42)    #random n state
-epochs_ar = ar.fit_transform(epochs)
-
-ica = ICA(n_components = 16, max_iter = 'auto', random_state = 123)
-ica.fit(epochs_ar)
-
+epochs_ar, ar, reject_log = fit_autoreject(epochs,
+                                           picks,
+                                           n_interpolates,
+                                           consensus_percs,
+                                           thresh_method='random_search',
+                                           random_state=42,    #random n state
+                                           n_jobs=-1,
+                                           subject=file_name)
+
+# ICA is fitted on a high-passed, decimated copy and cached with its EOG picks;
+# reruns only apply it to the full-rate epochs
 ica_z_thresh = 1.96
-epochs_clean = epochs_ar.copy()
-eog_indices, eog_scores = ica.find_bads_eog(epochs_clean,
-                                            ch_name=['Fp1', 'F6'],
-                                            threshold=ica_z_thresh)
-ica.exclude = eog_indices
+ica, eog_indices, eog_scores = fit_ica(epochs_ar,
+                                       n_components=16,
+                                       random_state=123,
+                                       eog_channels=['Fp1', 'F6'],
+                                       eog_threshold=ica_z_thresh,
+                                       subject=file_name)
 print(eog_indices)
+epochs_clean = epochs_ar.copy()
 ica.apply(epochs_clean)
 epochs_final = epochs_clean.copy()
 del eeg_1020, epochs, epochs_ar, eog_indices, eog_scores, drop_channels
@@ -97,8 +109,22 @@ blank = epochs_final['Stimulus/s2'].apply_baseline(baseline).average()
 #fig = mne.viz.plot_compare_evokeds(VEP, picks='Oz', show=False)
 #fig[0].savefig("VEP Data/VEP_Oz")
 
-fig = mne.viz.plot_compare_evokeds(VEP, picks=picks, combine="mean", show=False)
-#fig[0].savefig("VEP Data/VEP_All")
+# Combine every ROI for every condition once and save them, so the figures can be
+# redrawn later without rerunning the pipeline (python roi.py "VEP Data/<file>_rois.npz" "VEP Data"),
+# then render all figures headlessly in parallel. VEP_Occipital and VEP_POz keep
+# their old file names; VEP_All and VEP_Occipital1 were only shown on screen before
+rois = dict(DEFAULT_ROIS, All=[epochs_final.ch_names[i] for i in picks])
+roi_waveforms = combine_rois({'Checkerboard': VEP, 'Check_2': VEP_2, 'Blank': blank}, rois)
+save_rois(os.path.join("VEP Data", file_name + "_rois.npz"), roi_waveforms)
+roi_colors = dict(Checkerboard="orange", Check_2="red", Blank="black")
+figure_files = export_figures(roi_waveforms,
+                              "VEP Data",
+                              figures=[('All', ['Checkerboard'], 'VEP_All'),
+                                       ('Occipital', ['Checkerboard'], 'VEP_Occipital1'),
+                                       ('Occipital_3', ['Checkerboard'], 'VEP_Occipital'),
+                                       ('POz', ['Checkerboard'], 'VEP_POz')],
+                              colors=roi_colors)
+print(figure_files)
 
 #fig = mne.viz.plot_compare_evokeds(VEP, picks=['O1','O2','Oz','POz','PO3','PO4','PO5','PO6','PO7','PO8'], combine="mean", show=False, time_unit="ms")
 #fig[0].savefig("VEP Data/VEP_Occipital1")
@@ -117,16 +143,7 @@ fig = mne.viz.plot_compare_evokeds(VEP, picks=picks, combine="mean", show=False)
 
 #epochs_final['Stimulus/s1'].plot(n_epochs=1, events=True, picks='Oz')
 
-fig = mne.viz.plot_compare_evokeds(VEP, picks=['O1','O2','Oz','POz','PO4','PO6','PO8','PO3','PO5','PO7'], combine="mean", show=True, time_unit="ms")
-fig[0].savefig("VEP Data/VEP_Occipital")
-
 #fig = mne.viz.plot_compare_evokeds(VEP_shift, picks=picks, combine="mean", show=False, time_unit="ms")
 
-fig = mne.viz.plot_compare_evokeds(VEP, picks=['POz','O1','O2'], combine="mean", show=True, time_unit="ms")
-fig[0].savefig("VEP Data/VEP_Occipital")
-
-fig = mne.viz.plot_compare_evokeds(VEP, picks=['POz'], show=True, time_unit="ms")
-fig[0].savefig("VEP Data/VEP_POz")
-
 #fig = mne.viz.plot_compare_evokeds(dict(Checkboard=VEP, Blank=blank), colors=dict(Checkboard="orange", Blank="black"), picks=['O1','O2','Oz','POz','PO4','PO6','PO8','PO3','PO5','PO7'], time_unit="ms", combine="mean")
 #fig[0].savefig("VEP Data/Compare_Stimuli")
@@ -1,7 +1,17 @@
-from psychopy import visual, core, event
+from psychopy import visual, core
 from pylsl import StreamInfo, StreamOutlet
 import time
 from datetime import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from checkerboard import CheckerboardStim
+from frame_timing import FrameTimer
+from paradigm import BLANK, FIXATION, CHECKERBOARD, Block, Marker, LslMarkers, compile_timeline, run_timeline
+from startup import prewarm, time_to_first_frame
+
+t_start = core.getTime()
 
 # Set up window
 win = visual.Window(size=(2560, 1440), fullscr=True, monitor='display_stimuli', screen=1, units='pix')
@@ -19,65 +29,47 @@ duration = 2     # Duration of the experiment (seconds) #increased from 1 to 2 f
 fixation_size = 30 #changed size of fixation from 15 to 30
 lineWidth = 15
 
-# Send first event
-core.wait(5)  # wait before paradigm starts
-outlet.push_sample([5])
-outlet.push_sample([5])
-outlet.push_sample([5])
+# LSL marker codes
+start_marker = Marker("start", "5", 5)
+fixation_marker = Marker("fixation_shown", "1", 1)
+checkerboard_marker = Marker("checkerboard_end", "2", 2)
 
-# Create checkerboard stimulus
+# Create checkerboard stimulus (arrays cached on disk between runs)
 num_squares = 260 #15
-colors = [[-1, 1] if (x + y) % 2 == 0 else [1, -1]
-          for x in range(num_squares) for y in range(num_squares)]
-checkerboard = visual.ElementArrayStim(win, nElements=num_squares**2, sizes=(check_size, check_size),
-                                       xys=[((x - num_squares // 2) * check_size, (y - num_squares // 2) * check_size)
-                                            for x in range(num_squares) for y in range(num_squares)],
-                                       elementTex=None, elementMask=None, colors=colors, colorSpace='rgb')
+checkerboard = CheckerboardStim(win, num_squares=num_squares, check_size=check_size, check_freq=check_freq, n_phases=4)
 
 # Create fixation point stimulus
 fixation_vertical = visual.Line(win, start=(0, -fixation_size), end=(0, fixation_size), lineColor="red", lineWidth=lineWidth)
 fixation_horizontal = visual.Line(win, start=(-fixation_size, 0), end=(fixation_size, 0), lineColor="red", lineWidth=lineWidth)
+fixation = [fixation_vertical, fixation_horizontal]
 
-# Main loop
-win.flip()
-print("start")
-print(core.getTime()) 
+# Warm up stimuli and wait for steady flips before the first marker
+startup = prewarm(win, checkerboard, fixation)
+print(startup)
+frame_rate = round(1 / startup["frame_period"])
 
+# Paradigm: wait 5 s before paradigm starts, then 10 x (10 x 1 s fixation, 10 x checkerboard), then 5 x 1 s fixation
+blocks = [Block(BLANK, 5, end=(start_marker,) * 3)]
 for n in range(10):
-    for i in range(10):
-        fixation_vertical.draw()
-        fixation_horizontal.draw()
-        win.flip()
-        outlet.push_sample([1])
-        core.wait(1)
-    for i in range(10):
-        start_time = core.getTime()
-        while core.getTime() - start_time < duration:
-            t = core.getTime() - start_time
-            phase = int(t * check_freq) % 4 #changed from 1 to 2 for frequency 1; changed from 2 to 4 for frequency 0.5
-            colors = [[-1, -1, -1] if (x + y + phase) % 2 == 0 else [1, 1, 1]
-                      for x in range(num_squares) for y in range(num_squares)]
-            checkerboard.colors = colors
-            checkerboard.draw()
-            fixation_vertical.draw()
-            fixation_horizontal.draw()
-            win.flip()
-        outlet.push_sample([2])
-        for keys in event.getKeys():
-            if 'escape' in keys:
-                win.close()
-                core.quit()    
+    blocks += [Block(FIXATION, 1, start=fixation_marker)] * 10
+    blocks += [Block(CHECKERBOARD, duration, end=checkerboard_marker, check_keys=True)] * 10
+blocks += [Block(FIXATION, 1, start=fixation_marker)] * 5
+blocks += [Block(BLANK, 0, start=start_marker)]
+timeline = compile_timeline(blocks, frame_rate, check_freq, n_phases=4) #changed from 2 to 4 phases for frequency 0.5
 
-for i in range(5):
-    fixation_vertical.draw()
-    fixation_horizontal.draw()
-    win.flip()
-    outlet.push_sample([1])
-    core.wait(1)
+# Flip timing for every frame
+timer = FrameTimer(frame_period=1 / frame_rate)
+
+# Main loop
+print("start")
+print(core.getTime()) 
+run_timeline(win, timeline, checkerboard, fixation, LslMarkers(outlet), timer=timer)
 
 # Clean up
-outlet.push_sample([5])
 print("end")
 print(core.getTime())
+print(f"time to first frame: {time_to_first_frame(timer, t_start):.3f} s")
+print(timer.summary())
+timer.save(f"frame_timing_{datetime.now():%Y-%m-%d_%H-%M-%S}.npz")
 win.close()
 core.quit()
@@ -0,0 +1,161 @@
+"""Photodiode latencies for every session under Photodiode Data/, in parallel.
+
+Each recording (Photodiode Data/<date>/*.vhdr with its .eeg) goes through
+photodiode.stream_onsets in a process pool. Results are written as two CSV
+tables next to the data:
+
+    photodiode_summary.csv   one row per recording: counts, median, 95% CI
+    photodiode_events.csv    one row per marker: onset sample and latency
+
+Recordings whose .vhdr/.vmrk/.eeg and settings are unchanged since the last
+run are taken from the existing tables instead of being processed again.
+
+    python batch_latencies.py                 # all sessions
+    python batch_latencies.py --force         # reprocess everything
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import brainvision
+from photodiode import stream_onsets
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Photodiode Data")
+
+SUMMARY_FIELDS = ["session", "recording", "sfreq", "n_events", "n_valid", "n_missing",
+                  "median_ms", "ci_low_ms", "ci_high_ms", "mean_ms", "std_ms", "signature"]
+EVENT_FIELDS = ["session", "recording", "event", "marker_sample", "onset_sample", "latency_ms"]
+
+
+def find_recordings(data_dir=DATA_DIR):
+    """Every .vhdr under data_dir/*/ whose .eeg file is present."""
+    found = []
+    for vhdr in sorted(glob.glob(os.path.join(data_dir, "*", "*.vhdr"))):
+        if os.path.exists(brainvision.read_header(vhdr).data_file):
+            found.append(vhdr)
+    return found
+
+
+def signature(vhdr, settings):
+    """Sizes and modification times of a recording's files, plus the settings."""
+    header = brainvision.read_header(vhdr)
+    files = [vhdr, header.marker_file, header.data_file]
+    stats = [(os.path.getsize(f), os.stat(f).st_mtime_ns) for f in files]
+    return json.dumps([stats, settings], sort_keys=True)
+
+
+def median_ci(values, n_boot=2000, level=0.95, seed=0):
+    """Bootstrap confidence interval of the median."""
+    rng = np.random.default_rng(seed)
+    medians = np.median(rng.choice(values, (n_boot, len(values))), axis=1)
+    return np.percentile(medians, [50 * (1 - level), 50 * (1 + level)])
+
+
+def process(vhdr, data_dir, settings):
+    """Run one recording; returns (summary row, event rows)."""
+    result = stream_onsets(vhdr, **settings)
+    session = os.path.relpath(os.path.dirname(vhdr), data_dir)
+    recording = os.path.splitext(os.path.basename(vhdr))[0]
+    latencies_ms = result.latencies * 1e3
+    valid = latencies_ms[result.valid]
+    summary = {
+        "session": session,
+        "recording": recording,
+        "sfreq": brainvision.read_header(vhdr).sfreq,
+        "n_events": len(result.markers),
+        "n_valid": int(result.valid.sum()),
+        "n_missing": int((~result.valid).sum()),
+        "median_ms": "", "ci_low_ms": "", "ci_high_ms": "", "mean_ms": "", "std_ms": "",
+        "signature": signature(vhdr, settings),
+    }
+    if len(valid):
+        low, high = median_ci(valid)
+        summary.update(median_ms=np.median(valid), ci_low_ms=low, ci_high_ms=high,
+                       mean_ms=valid.mean(), std_ms=valid.std())
+    events = [
+        {"session": session, "recording": recording, "event": i,
+         "marker_sample": int(marker), "onset_sample": int(onset),
+         "latency_ms": "" if np.isnan(latency) else latency}
+        for i, (marker, onset, latency) in enumerate(zip(result.markers["sample"], result.onsets, latencies_ms))
+    ]
+    return summary, events
+
+
+def _read_csv(fname):
+    if not os.path.exists(fname):
+        return []
+    with open(fname, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _write_csv(fname, fields, rows):
+    with open(fname, "w", newline="") as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run(data_dir=DATA_DIR, out_dir=None, settings=None, force=False, workers=None):
+    """Process new or changed recordings and rewrite the summary tables.
+
+    Returns the summary rows, one per recording.
+    """
+    out_dir = out_dir or data_dir
+    os.makedirs(out_dir, exist_ok=True)
+    settings = settings or {"pattern": "s2", "tmin": 0.0, "tmax": 0.5, "h_freq": 40.0, "mad_factor": 4}
+    summary_file = os.path.join(out_dir, "photodiode_summary.csv")
+    events_file = os.path.join(out_dir, "photodiode_events.csv")
+
+    old_summary = {(r["session"], r["recording"]): r for r in _read_csv(summary_file)}
+    old_events = {}
+    for row in _read_csv(events_file):
+        old_events.setdefault((row["session"], row["recording"]), []).append(row)
+
+    summaries, events, todo = {}, {}, []
+    for vhdr in find_recordings(data_dir):
+        key = (os.path.relpath(os.path.dirname(vhdr), data_dir), os.path.splitext(os.path.basename(vhdr))[0])
+        old = old_summary.get(key)
+        if not force and old is not None and old["signature"] == signature(vhdr, settings):
+            summaries[key] = old
+            events[key] = old_events.get(key, [])
+        else:
+            todo.append((key, vhdr))
+
+    if todo:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [(key, pool.submit(process, vhdr, data_dir, settings)) for key, vhdr in todo]
+            for key, future in futures:
+                summaries[key], events[key] = future.result()
+                print(f"{key[0]}/{key[1]}: {summaries[key]['n_valid']}/{summaries[key]['n_events']} events, "
+                      f"median {summaries[key]['median_ms']} ms")
+    print(f"{len(todo)} processed, {len(summaries) - len(todo)} unchanged")
+
+    keys = sorted(summaries)
+    _write_csv(summary_file, SUMMARY_FIELDS, [summaries[k] for k in keys])
+    _write_csv(events_file, EVENT_FIELDS, [row for k in keys for row in events[k]])
+    return [summaries[k] for k in keys]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--out-dir", help="where to write the tables (default: data dir)")
+    parser.add_argument("--pattern", default="s2", help="Stimulus marker description regex")
+    parser.add_argument("--tmax", type=float, default=0.5)
+    parser.add_argument("--h-freq", type=float, default=40.0)
+    parser.add_argument("--mad-factor", type=float, default=4)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--force", action="store_true", help="reprocess unchanged recordings too")
+    args = parser.parse_args()
+    settings = {"pattern": args.pattern, "tmin": 0.0, "tmax": args.tmax, "h_freq": args.h_freq,
+                "mad_factor": args.mad_factor}
+    run(args.data_dir, args.out_dir, settings, args.force, args.workers)
+
+
+if __name__ == "__main__":
+    main()
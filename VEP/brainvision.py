@@ -0,0 +1,212 @@
+"""Minimal BrainVision (.vhdr/.vmrk/.eeg) reading without MNE.
+
+Only what the photodiode and VEP tools need: the header, the markers,
+chunked access to single channels of a binary MULTIPLEXED .eeg file, and
+BrainVisionReader, which memory-maps the .eeg so channel subsets and time
+windows are views rather than a full float64 load_data().
+Sample positions are 0-based, as in MNE (BrainVision files are 1-based).
+"""
+import configparser
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+BINARY_FORMATS = {
+    "IEEE_FLOAT_32": np.dtype("<f4"),
+    "INT_16": np.dtype("<i2"),
+    "UINT_16": np.dtype("<u2"),
+}
+
+BrainVisionHeader = namedtuple("BrainVisionHeader", [
+    "data_file", "marker_file", "n_channels", "sfreq", "ch_names", "scales", "dtype", "orientation"])
+BrainVisionHeader.__doc__ = """Parsed .vhdr. scales convert raw values to volts per channel."""
+
+MARKER_DTYPE = np.dtype([
+    ("type", "U32"),
+    ("description", "U32"),
+    ("sample", np.int64),
+    ("size", np.int64),
+    ("channel", np.int32),
+])
+
+
+def _read_ini(fname):
+    # BrainVision files are INI-like, with a free-text first line and ; comments
+    with open(fname, encoding="latin-1") as f:
+        lines = f.read().splitlines()[1:]
+    parser = configparser.ConfigParser(interpolation=None, comment_prefixes=(";",), strict=False)
+    parser.optionxform = str
+    parser.read_string("\n".join(lines))
+    return parser
+
+
+def read_header(vhdr):
+    """Parse a .vhdr file. Data and marker paths are resolved next to it."""
+    ini = _read_ini(vhdr)
+    common = ini["Common Infos"]
+    folder = os.path.dirname(os.path.abspath(vhdr))
+    n_channels = int(common["NumberOfChannels"])
+    ch_names, scales = [], []
+    for i in range(1, n_channels + 1):
+        fields = ini["Channel Infos"][f"Ch{i}"].split(",")
+        ch_names.append(fields[0].replace("\\1", ","))
+        resolution = float(fields[2]) if len(fields) > 2 and fields[2] else 1.0
+        unit = fields[3] if len(fields) > 3 else "µV"
+        scales.append(resolution * (1e-6 if unit in ("µV", "uV", "") else 1e-3 if unit == "mV" else 1.0))
+    return BrainVisionHeader(
+        data_file=os.path.join(folder, common["DataFile"]),
+        marker_file=os.path.join(folder, common["MarkerFile"]) if "MarkerFile" in common else None,
+        n_channels=n_channels,
+        sfreq=1e6 / float(common["SamplingInterval"]),
+        ch_names=ch_names,
+        scales=np.array(scales),
+        dtype=BINARY_FORMATS[ini["Binary Infos"]["BinaryFormat"]],
+        orientation=common.get("DataOrientation", "MULTIPLEXED"),
+    )
+
+
+def read_markers(vmrk):
+    """Parse a .vmrk file into a MARKER_DTYPE structured array."""
+    ini = _read_ini(vmrk)
+    rows = []
+    for key, value in ini["Marker Infos"].items():
+        fields = value.split(",")
+        rows.append((
+            fields[0].replace("\\1", ","),
+            fields[1].replace("\\1", ","),
+            int(fields[2]) - 1,
+            int(fields[3]) if len(fields) > 3 and fields[3] else 1,
+            int(fields[4]) if len(fields) > 4 and fields[4] else 0,
+        ))
+    return np.array(rows, dtype=MARKER_DTYPE)
+
+
+def stimulus_markers(markers, pattern=r"s\d+"):
+    """Stimulus markers whose description fully matches pattern, sorted by sample."""
+    regex = re.compile(pattern)
+    keep = np.array([t == "Stimulus" and regex.fullmatch(d) is not None
+                     for t, d in zip(markers["type"], markers["description"])], dtype=bool)
+    selected = markers[keep]
+    return selected[np.argsort(selected["sample"], kind="stable")]
+
+
+def n_samples(header):
+    return os.path.getsize(header.data_file) // (header.dtype.itemsize * header.n_channels)
+
+
+def iter_channel_chunks(header, channel, chunk_size):
+    """Yield (first_sample, data) blocks of one channel, in volts (float64).
+
+    Reads chunk_size samples of all channels at a time, so memory stays
+    constant regardless of recording length.
+    """
+    if header.orientation != "MULTIPLEXED":
+        raise ValueError(f"Only MULTIPLEXED data is supported, not {header.orientation}")
+    idx = header.ch_names.index(channel)
+    scale = header.scales[idx]
+    start = 0
+    with open(header.data_file, "rb") as f:
+        while True:
+            block = np.fromfile(f, dtype=header.dtype, count=chunk_size * header.n_channels)
+            n = len(block) // header.n_channels
+            if n == 0:
+                return
+            data = block[:n * header.n_channels].reshape(n, header.n_channels)[:, idx] * scale
+            yield start, data
+            start += n
+
+
+def _as_slice(idx):
+    # Channel indices in arithmetic progression can be a strided view
+    if len(idx) == 1:
+        return slice(idx[0], idx[0] + 1)
+    step = idx[1] - idx[0]
+    if step != 0 and all(b - a == step for a, b in zip(idx, idx[1:])):
+        stop = idx[-1] + step
+        return slice(idx[0], stop if stop >= 0 else None, step)
+    return None
+
+
+class BrainVisionReader:
+    """Memory-mapped BrainVision recording.
+
+    data is a read-only (n_times, n_channels) view of the .eeg in its stored
+    dtype and units (float32 for our files); multiply by scales for volts.
+    Nothing is read from disk until a slice of it is used.
+
+    Parameters
+    ----------
+    vhdr : str
+        BrainVision header file.
+    """
+
+    def __init__(self, vhdr):
+        self.header = read_header(vhdr)
+        if self.header.orientation != "MULTIPLEXED":
+            raise ValueError(f"Only MULTIPLEXED data is supported, not {self.header.orientation}")
+        if self.header.marker_file and os.path.exists(self.header.marker_file):
+            self.markers = read_markers(self.header.marker_file)
+        else:
+            self.markers = np.empty(0, dtype=MARKER_DTYPE)
+        self.sfreq = self.header.sfreq
+        self.ch_names = self.header.ch_names
+        self.data = np.memmap(self.header.data_file, dtype=self.header.dtype, mode="r",
+                              shape=(n_samples(self.header), self.header.n_channels))
+
+    @property
+    def n_times(self):
+        return self.data.shape[0]
+
+    def pick(self, channels):
+        """Channel indices for a name, a list of names, or None (all)."""
+        if channels is None:
+            return list(range(len(self.ch_names)))
+        if isinstance(channels, str):
+            channels = [channels]
+        return [self.ch_names.index(ch) for ch in channels]
+
+    def get(self, channels=None, start=0, stop=None):
+        """Samples start:stop of the given channels, shape (n, n_picked).
+
+        A view without copying when the channels are evenly spaced in the
+        file (any single channel or pair, or a contiguous run); otherwise
+        only the requested window is copied.
+        """
+        idx = self.pick(channels)
+        window = self.data[start:stop]
+        cols = _as_slice(idx)
+        return window[:, cols] if cols is not None else window[:, idx]
+
+    def epochs(self, samples, channels=None, tmin=-0.1, tmax=0.5):
+        """Cut epochs around the given samples, in volts.
+
+        Returns (data, keep): data has shape (n_kept, n_channels, n_times),
+        float32, and keep marks the samples whose window fit in the recording.
+        """
+        idx = self.pick(channels)
+        first = int(round(tmin * self.sfreq))
+        n_times = int(round((tmax - tmin) * self.sfreq)) + 1
+        starts = np.asarray(samples, dtype=np.int64) + first
+        keep = (starts >= 0) & (starts + n_times <= self.n_times)
+        rows = starts[keep][:, None] + np.arange(n_times)
+        data = self.get(channels)[rows]
+        data = data.astype(np.float32) * self.header.scales[idx].astype(np.float32)
+        return data.transpose(0, 2, 1), keep
+
+    def to_raw(self, channels=None, ch_types="eeg"):
+        """An mne.io.RawArray of only the given channels, with the markers as annotations."""
+        import mne
+
+        idx = self.pick(channels)
+        data = np.asarray(self.get(channels), dtype=np.float64) * self.header.scales[idx]
+        info = mne.create_info([self.ch_names[i] for i in idx], self.sfreq, ch_types)
+        raw = mne.io.RawArray(data.T, info, verbose=False)
+        markers = self.markers[self.markers["sample"] >= 0]
+        raw.set_annotations(mne.Annotations(
+            markers["sample"] / self.sfreq,
+            np.zeros(len(markers)),
+            [f"{t}/{d}" for t, d in zip(markers["type"], markers["description"])],
+        ))
+        return raw
@@ -0,0 +1,160 @@
+"""Artifact rejection for the VEP pipeline, with on-disk caching.
+
+AutoReject's cross-validated threshold search is the slowest step of the
+old VEP scripts. fit_autoreject runs it on all cores and saves the fitted
+object (thresholds and consensus) under
+
+    .cleaning_cache/<subject>/<session>/autoreject_<hash>.h5
+
+where the hash covers the epochs' data, channels, events and the AutoReject
+parameters, so a rerun on the same epochs loads it instead of refitting.
+ptp_prescreen drops grossly contaminated epochs first, which also makes the
+search cheaper.
+
+fit_ica does the same for ICA: it fits on a high-passed, decimated copy of
+the epochs, finds the EOG components, and caches both (ica_<hash>-ica.fif
+plus a .json of the EOG picks). The cached decomposition is applied to the
+full-rate epochs without refitting.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cleaning_cache")
+
+
+def epochs_hash(epochs, **params):
+    """Content hash of epochs (data, channels, sfreq, events) and parameters."""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(epochs.get_data()).tobytes())
+    h.update(np.ascontiguousarray(epochs.events).tobytes())
+    h.update(json.dumps([epochs.ch_names, epochs.info["sfreq"], params], sort_keys=True, default=str).encode())
+    return h.hexdigest()[:16]
+
+
+def cache_path(kind, digest, subject=None, session=None, cache_dir=CACHE_DIR, ext=".h5"):
+    folder = os.path.join(cache_dir, str(subject or "default"), str(session or "default"))
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{kind}_{digest}{ext}")
+
+
+def ptp_prescreen(epochs, picks=None, max_ptp=500e-6):
+    """Drop epochs whose peak-to-peak amplitude exceeds max_ptp (V) on any picked channel.
+
+    Works in place on epochs (like epochs.drop) and returns them.
+    """
+    ptp = np.ptp(epochs.get_data(picks=picks), axis=-1)
+    bad = np.flatnonzero((ptp > max_ptp).any(axis=1))
+    if len(bad):
+        epochs.drop(bad, reason="PTP")
+    return epochs
+
+
+def fit_autoreject(epochs, picks=None, n_interpolates=(1, 4, 32), consensus_percs=np.linspace(0, 1.0, 11),
+                   thresh_method="random_search", random_state=42, n_jobs=-1,
+                   subject=None, session=None, cache_dir=CACHE_DIR):
+    """Fit AutoReject (or load a cached fit) and clean the epochs.
+
+    Parameters
+    ----------
+    epochs : mne.Epochs
+    picks : array-like | None
+        Channels AutoReject works on.
+    n_interpolates, consensus_percs, thresh_method, random_state
+        Passed to AutoReject; part of the cache key.
+    n_jobs : int
+        Cores for the cross-validation search (-1 for all).
+    subject, session : str | None
+        Cache subfolders.
+
+    Returns
+    -------
+    epochs_ar : mne.Epochs
+        Cleaned copy of the epochs.
+    ar : AutoReject
+    reject_log : RejectLog
+    """
+    from autoreject import AutoReject, read_auto_reject
+
+    params = {
+        "picks": None if picks is None else np.asarray(picks).tolist(),
+        "n_interpolates": np.asarray(n_interpolates).tolist(),
+        "consensus_percs": np.asarray(consensus_percs).tolist(),
+        "thresh_method": thresh_method,
+        "random_state": random_state,
+    }
+    fname = cache_path("autoreject", epochs_hash(epochs, **params), subject, session, cache_dir)
+    if os.path.exists(fname):
+        ar = read_auto_reject(fname)
+    else:
+        ar = AutoReject(np.asarray(n_interpolates), np.asarray(consensus_percs), picks=picks,
+                        thresh_method=thresh_method, random_state=random_state, n_jobs=n_jobs)
+        ar.fit(epochs)
+        ar.save(fname, overwrite=True)
+    epochs_ar, reject_log = ar.transform(epochs, return_log=True)
+    return epochs_ar, ar, reject_log
+
+
+def fit_ica(epochs, n_components=16, random_state=123, fit_l_freq=1.0, decim=None,
+            eog_channels=("Fp1", "F6"), eog_threshold=1.96, subject=None, session=None, cache_dir=CACHE_DIR):
+    """Fit ICA (or load a cached fit) and mark the EOG components for exclusion.
+
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Full-rate epochs; they are not modified.
+    n_components, random_state
+        Passed to ICA.
+    fit_l_freq : float | None
+        High-pass applied to the copy ICA is fitted on, unless the epochs are
+        already high-passed at least this much.
+    decim : int | None
+        Decimation for fitting. None keeps about three samples per period of
+        the epochs' low-pass cutoff.
+    eog_channels, eog_threshold
+        Passed to find_bads_eog as ch_name and threshold.
+    subject, session : str | None
+        Cache subfolders.
+
+    Returns
+    -------
+    ica : mne.preprocessing.ICA
+        With ica.exclude set to the EOG components; use ica.apply(epochs.copy()).
+    eog_indices : list of int
+    eog_scores : ndarray
+    """
+    from mne.preprocessing import ICA, read_ica
+
+    sfreq = epochs.info["sfreq"]
+    if decim is None:
+        decim = max(1, int(sfreq // (3 * epochs.info["lowpass"])))
+    params = {
+        "n_components": n_components,
+        "random_state": random_state,
+        "fit_l_freq": fit_l_freq,
+        "decim": decim,
+        "eog_channels": list(eog_channels),
+        "eog_threshold": eog_threshold,
+    }
+    fname = cache_path("ica", epochs_hash(epochs, **params), subject, session, cache_dir, ext="-ica.fif")
+    eog_fname = fname[:-len("-ica.fif")] + "_eog.json"
+    if os.path.exists(fname) and os.path.exists(eog_fname):
+        ica = read_ica(fname, verbose=False)
+        with open(eog_fname) as f:
+            eog = json.load(f)
+        ica.exclude = eog["indices"]
+        return ica, eog["indices"], np.array(eog["scores"])
+
+    fit_epochs = epochs
+    if fit_l_freq is not None and (epochs.info["highpass"] or 0) < fit_l_freq:
+        fit_epochs = epochs.copy().filter(fit_l_freq, None, verbose=False)
+    ica = ICA(n_components=n_components, max_iter="auto", random_state=random_state)
+    ica.fit(fit_epochs, decim=decim)
+    eog_indices, eog_scores = ica.find_bads_eog(epochs, ch_name=list(eog_channels), threshold=eog_threshold)
+    ica.exclude = list(eog_indices)
+    ica.save(fname, overwrite=True)
+    with open(eog_fname, "w") as f:
+        json.dump({"indices": [int(i) for i in eog_indices], "scores": np.asarray(eog_scores).tolist()}, f)
+    return ica, list(eog_indices), np.asarray(eog_scores)
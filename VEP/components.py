@@ -0,0 +1,103 @@
+"""Peak and trough measurement of VEP components.
+
+measure_components stacks any number of evoked responses (e.g. the s1/s2/s3
+conditions) into one (n_conditions, n_channels, n_times) array and finds the
+maximum and minimum of every channel in every named latency window in one
+pass per window, using index slices computed once from the shared times.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+# Standard pattern-reversal VEP windows, in seconds
+DEFAULT_WINDOWS = OrderedDict([
+    ("N75", (0.06, 0.09)),
+    ("P100", (0.08, 0.12)),
+    ("N135", (0.12, 0.16)),
+])
+
+COMPONENT_DTYPE = np.dtype([
+    ("condition", "U32"),
+    ("channel", "U16"),
+    ("window", "U16"),
+    ("peak_amp", np.float64),
+    ("peak_latency", np.float64),
+    ("trough_amp", np.float64),
+    ("trough_latency", np.float64),
+])
+
+
+def window_slices(times, windows):
+    """Index slice of times for each (tmin, tmax) window, both ends inclusive."""
+    times = np.asarray(times)
+    slices = OrderedDict()
+    for name, (tmin, tmax) in windows.items():
+        start, stop = np.searchsorted(times, tmin, "left"), np.searchsorted(times, tmax, "right")
+        if stop <= start:
+            raise ValueError(f"Window {name} ({tmin}, {tmax}) contains no samples")
+        slices[name] = slice(start, stop)
+    return slices
+
+
+def measure_array(data, times, windows=DEFAULT_WINDOWS):
+    """Peaks and troughs of stacked data for each window.
+
+    Parameters
+    ----------
+    data : ndarray, shape (..., n_times)
+    times : ndarray, shape (n_times,)
+    windows : dict
+        Window name -> (tmin, tmax) in seconds.
+
+    Returns
+    -------
+    dict
+        Window name -> (peak_amp, peak_latency, trough_amp, trough_latency),
+        each shaped like data without its last axis.
+    """
+    times = np.asarray(times)
+    out = OrderedDict()
+    for name, sl in window_slices(times, windows).items():
+        segment = data[..., sl]
+        peak = segment.argmax(axis=-1)
+        trough = segment.argmin(axis=-1)
+        out[name] = (
+            np.take_along_axis(segment, peak[..., None], -1)[..., 0],
+            times[sl][peak],
+            np.take_along_axis(segment, trough[..., None], -1)[..., 0],
+            times[sl][trough],
+        )
+    return out
+
+
+def measure_components(evokeds, picks=None, windows=DEFAULT_WINDOWS):
+    """Measure all conditions, channels and windows at once.
+
+    Parameters
+    ----------
+    evokeds : dict
+        Condition name -> mne.Evoked; all must share channels and times.
+    picks : list of str | None
+        Channel names to measure (default: all).
+    windows : dict
+        Window name -> (tmin, tmax) in seconds, e.g. {'P100': (0.08, 0.12)}.
+
+    Returns
+    -------
+    ndarray of COMPONENT_DTYPE
+        One row per condition, channel and window.
+    """
+    conditions = list(evokeds)
+    first = evokeds[conditions[0]]
+    channels = list(first.ch_names) if picks is None else list(picks)
+    idx = [first.ch_names.index(ch) for ch in channels]
+    data = np.stack([evokeds[c].data[idx] for c in conditions])
+    measured = measure_array(data, first.times, windows)
+
+    table = np.empty((len(conditions), len(channels), len(measured)), dtype=COMPONENT_DTYPE)
+    table["condition"] = np.array(conditions)[:, None, None]
+    table["channel"] = np.array(channels)[None, :, None]
+    table["window"] = np.array(list(measured))[None, None, :]
+    for field, i in (("peak_amp", 0), ("peak_latency", 1), ("trough_amp", 2), ("trough_latency", 3)):
+        table[field] = np.stack([values[i] for values in measured.values()], axis=-1)
+    return table.ravel()
@@ -0,0 +1,268 @@
+"""Online VEP monitor for LSL marker + EEG streams.
+
+OnlineVEP pulls both streams, keeps the last few seconds of EEG in a fixed
+ring buffer, cuts an epoch for each marker once its window has arrived, and
+updates a running VEP average and photodiode latency estimate. Memory does
+not grow with session length.
+
+    python online_vep.py              # connect to the VEP markers + EEG streams
+    python online_vep.py --simulate   # drive it from local simulated outlets
+"""
+import argparse
+import threading
+from collections import deque
+from time import sleep
+
+import numpy as np
+from pylsl import StreamInfo, StreamInlet, StreamOutlet, local_clock, proc_clocksync, proc_dejitter, resolve_byprop
+
+from photodiode import detect_latencies
+
+
+class RingBuffer:
+    """Last `capacity` samples of a multichannel stream.
+
+    Every sample is written twice (at i and i + capacity), so any window of
+    up to `capacity` recent samples is a contiguous slice, never a copy.
+    """
+
+    def __init__(self, capacity, n_channels, dtype=np.float32):
+        self.capacity = capacity
+        self.data = np.zeros((2 * capacity, n_channels), dtype=dtype)
+        self.times = np.zeros(2 * capacity, dtype=np.float64)
+        self.count = 0
+
+    def append(self, samples, timestamps):
+        samples = np.asarray(samples, dtype=self.data.dtype)[-self.capacity:]
+        timestamps = np.asarray(timestamps, dtype=np.float64)[-self.capacity:]
+        n = len(samples)
+        idx = (self.count + np.arange(n)) % self.capacity
+        self.data[idx] = samples
+        self.data[idx + self.capacity] = samples
+        self.times[idx] = timestamps
+        self.times[idx + self.capacity] = timestamps
+        self.count += n
+
+    def _recent(self):
+        if self.count < self.capacity:
+            return 0, self.count
+        return self.count % self.capacity, self.capacity
+
+    @property
+    def last_time(self):
+        if self.count == 0:
+            return -np.inf
+        return self.times[(self.count - 1) % self.capacity]
+
+    def window(self, t_start, n_times, tol=0.0):
+        """n_times samples starting at the first timestamp >= t_start.
+
+        Returns None if the window is not complete yet, or if it starts more
+        than tol seconds before the oldest sample still held.
+        """
+        start, n = self._recent()
+        times = self.times[start:start + n]
+        first = np.searchsorted(times, t_start)
+        if n == 0 or first + n_times > n:
+            return None
+        if first == 0 and times[0] - t_start > tol:
+            return None
+        return self.data[start + first:start + first + n_times]
+
+
+class RunningAverage:
+    """Incremental (Welford) mean and variance of fixed-shape epochs."""
+
+    def __init__(self, shape):
+        self.n = 0
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def sem(self):
+        if self.n < 2:
+            return np.full_like(self.mean, np.nan)
+        return np.sqrt(self._m2 / (self.n - 1) / self.n)
+
+
+def channel_names(info):
+    """Channel labels from an LSL StreamInfo description."""
+    names = []
+    ch = info.desc().child("channels").child("channel")
+    for _ in range(info.channel_count()):
+        names.append(ch.child_value("label"))
+        ch = ch.next_sibling()
+    return names
+
+
+class OnlineVEP:
+    """Running VEP average and photodiode latency from LSL streams.
+
+    Parameters
+    ----------
+    eeg_inlet, marker_inlet : pylsl.StreamInlet
+    picks : list of str
+        EEG channels to average.
+    photodiode : str | None
+        Channel carrying the photodiode.
+    marker_codes : tuple of int
+        Marker values that start an epoch.
+    tmin, tmax : float
+        Epoch window around each marker, in seconds.
+    buffer_s : float
+        Seconds of EEG kept in the ring buffer.
+    mad_factor : float
+        Photodiode threshold, in MADs above the median.
+    """
+
+    def __init__(self, eeg_inlet, marker_inlet, picks, photodiode=None, marker_codes=(2,),
+                 tmin=-0.1, tmax=0.5, buffer_s=10.0, mad_factor=4, n_latencies=500):
+        info = eeg_inlet.info()
+        names = channel_names(info)
+        self.sfreq = info.nominal_srate()
+        self.eeg_inlet = eeg_inlet
+        self.marker_inlet = marker_inlet
+        self.picks = picks
+        self.pick_idx = [names.index(ch) for ch in picks]
+        self.photodiode_idx = names.index(photodiode) if photodiode else None
+        self.marker_codes = set(marker_codes)
+        self.tmin = tmin
+        self.n_times = int(round((tmax - tmin) * self.sfreq)) + 1
+        self.times = tmin + np.arange(self.n_times) / self.sfreq
+        self.mad_factor = mad_factor
+        self.buffer = RingBuffer(int(buffer_s * self.sfreq), len(names))
+        self.averages = {code: RunningAverage((len(picks), self.n_times)) for code in marker_codes}
+        self.latencies = deque(maxlen=n_latencies)
+        self.n_missing_latency = 0
+        self.n_dropped = 0
+        self._pending = deque()
+
+    def poll(self):
+        """Pull whatever has arrived and process complete epochs. Returns epochs added."""
+        samples, timestamps = self.eeg_inlet.pull_chunk(timeout=0.0)
+        if timestamps:
+            self.buffer.append(samples, timestamps)
+        markers, marker_times = self.marker_inlet.pull_chunk(timeout=0.0)
+        for marker, t in zip(markers, marker_times):
+            if marker[0] in self.marker_codes:
+                self._pending.append((marker[0], t))
+
+        added = 0
+        epoch_span = (self.n_times - 1) / self.sfreq
+        while self._pending and self._pending[0][1] + self.tmin + epoch_span <= self.buffer.last_time:
+            code, t = self._pending.popleft()
+            epoch = self.buffer.window(t + self.tmin, self.n_times, tol=1 / self.sfreq)
+            if epoch is None:
+                self.n_dropped += 1
+                continue
+            self.averages[code].add(epoch[:, self.pick_idx].T)
+            if self.photodiode_idx is not None:
+                post = self.times >= 0
+                found = detect_latencies(epoch[post, self.photodiode_idx][None], self.times[post], self.mad_factor)
+                if found.valid[0]:
+                    self.latencies.append(found.latencies[0])
+                else:
+                    self.n_missing_latency += 1
+            added += 1
+        return added
+
+    def summary(self):
+        latencies = np.array(self.latencies)
+        return {
+            "epochs": {code: avg.n for code, avg in self.averages.items()},
+            "dropped": self.n_dropped,
+            "latency_median_ms": float(np.median(latencies) * 1e3) if len(latencies) else None,
+            "latency_iqr_ms": float(np.subtract(*np.percentile(latencies, [75, 25])) * 1e3) if len(latencies) else None,
+            "latency_missing": self.n_missing_latency,
+        }
+
+
+def simulate_outlets(sfreq=1000, channels=("Z12", "Z13", "LB3", "EKG"), photodiode="EKG", marker_code=2,
+                     interval=0.5, latency=0.03, noise=2e-6, duration=30.0, chunk=20):
+    """Stream synthetic EEG and markers on local LSL outlets from a daemon thread.
+
+    Each marker is followed after `latency` s by a photodiode step on the
+    photodiode channel and a small VEP-like deflection on the others.
+    Returns a threading.Event; set it to stop early.
+    """
+    eeg_info = StreamInfo("VEP_sim_EEG", "EEG", len(channels), sfreq, "float32", "vep-sim-eeg")
+    chans = eeg_info.desc().append_child("channels")
+    for name in channels:
+        chans.append_child("channel").append_child_value("label", name)
+    marker_info = StreamInfo("VEP_sim_markers", "Markers", 1, 0, "int32", "vep-sim-markers")
+    eeg_outlet = StreamOutlet(eeg_info, chunk_size=chunk)
+    marker_outlet = StreamOutlet(marker_info)
+    stop = threading.Event()
+    pd_idx = list(channels).index(photodiode)
+    rng = np.random.default_rng(0)
+
+    def run():
+        n_total = int(duration * sfreq)
+        t0 = local_clock()
+        next_marker = 1.0
+        onsets = []
+        for start in range(0, n_total, chunk):
+            if stop.is_set():
+                return
+            t = start / sfreq + np.arange(chunk) / sfreq
+            if t[0] >= next_marker:
+                marker_outlet.push_sample([marker_code], t0 + next_marker)
+                onsets.append(next_marker + latency)
+                next_marker += interval
+            data = rng.normal(0, noise, (chunk, len(channels))).astype(np.float32)
+            for onset in onsets[-2:]:
+                dt = t - onset
+                on = (dt >= 0) & (dt < interval / 2)
+                data[on, pd_idx] += 1e-3
+                vep = 5e-6 * np.exp(-((dt - 0.1) / 0.02) ** 2)
+                data[:, [i for i in range(len(channels)) if i != pd_idx]] += vep[:, None]
+            eeg_outlet.push_chunk(data.tolist(), list(t0 + t))
+            delay = t0 + (start + chunk) / sfreq - local_clock()
+            if delay > 0:
+                sleep(delay)
+
+    threading.Thread(target=run, name="vep-sim", daemon=True).start()
+    return stop
+
+
+def connect(eeg_type="EEG", marker_name="VEP", timeout=10.0):
+    """Resolve the EEG and marker streams and open clock-corrected inlets."""
+    flags = proc_clocksync | proc_dejitter
+    eeg = resolve_byprop("type", eeg_type, timeout=timeout)
+    markers = resolve_byprop("name", marker_name, timeout=timeout)
+    if not eeg or not markers:
+        raise RuntimeError(f"Could not find LSL streams (type={eeg_type!r}, name={marker_name!r})")
+    return StreamInlet(eeg[0], processing_flags=flags), StreamInlet(markers[0], processing_flags=flags)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--picks", nargs="+", default=["Z13"])
+    parser.add_argument("--photodiode", default="EKG")
+    parser.add_argument("--marker-code", type=int, nargs="+", default=[2])
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--simulate", action="store_true")
+    args = parser.parse_args()
+
+    if args.simulate:
+        simulate_outlets(marker_code=args.marker_code[0], duration=args.duration)
+        eeg_inlet, marker_inlet = connect(marker_name="VEP_sim_markers")
+    else:
+        eeg_inlet, marker_inlet = connect()
+    vep = OnlineVEP(eeg_inlet, marker_inlet, args.picks, args.photodiode, tuple(args.marker_code))
+
+    t_end = local_clock() + args.duration
+    while local_clock() < t_end:
+        if vep.poll():
+            print(vep.summary())
+        sleep(0.05)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Photodiode latency detection for the VEP rig.
+
+The photodiode is recorded on the EKG channel. A screen change shows up as a
+deflection, and its latency is the first sample whose rectified amplitude
+exceeds median + mad_factor * MAD of the epoch (the method from the
+Photodiode_VEP_Analysis notebooks).
+
+stream_onsets runs the same detector on a continuous BrainVision recording
+without MNE, reading only the photodiode channel chunk by chunk.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.signal import lfilter, lfilter_zi
+
+import brainvision
+from filtering import design_kernel
+
+PhotodiodeLatencies = namedtuple("PhotodiodeLatencies", ["latencies", "thresholds", "medians", "valid", "index"])
+PhotodiodeLatencies.__doc__ = """Result of detect_latencies, one entry per epoch.
+
+latencies are in seconds (NaN where no crossing was found), thresholds and
+medians are in the scaled units of the rectified signal, valid marks epochs
+with a crossing and index is the first sample above threshold."""
+
+
+def detect_latencies(data, times, mad_factor=4, interpolate=False, scale=1e3):
+    """Detect the photodiode onset in every epoch at once.
+
+    Parameters
+    ----------
+    data : ndarray, shape (n_epochs, n_times) or (n_epochs, 1, n_times)
+        Photodiode epochs, e.g. epochs.get_data(picks='EKG').
+    times : ndarray, shape (n_times,)
+        Epoch times in seconds (epochs.times).
+    mad_factor : float
+        Threshold in MADs above the median (2 is less strict).
+    interpolate : bool
+        Place the crossing between the last sample below and the first sample
+        above threshold by linear interpolation, instead of on the sample.
+    scale : float
+        Applied to the rectified signal (1e3 gives mV, as in the notebooks).
+
+    Returns
+    -------
+    PhotodiodeLatencies
+        As in the notebooks, a crossing on the very first sample counts as
+        no crossing.
+    """
+    data = np.asarray(data)
+    if data.ndim == 3:
+        data = data[:, 0]
+    rectified = np.abs(data)
+    rectified *= scale
+    medians = np.median(rectified, axis=1)
+    mad = np.median(np.abs(rectified - medians[:, None]), axis=1)
+    thresholds = medians + mad_factor * mad
+
+    index = np.argmax(rectified > thresholds[:, None], axis=1)
+    valid = index > 0
+    latencies = np.full(len(data), np.nan)
+    latencies[valid] = times[index[valid]]
+    if interpolate and valid.any():
+        rows = np.flatnonzero(valid)
+        above = rectified[rows, index[rows]]
+        below = rectified[rows, index[rows] - 1]
+        frac = (thresholds[rows] - below) / (above - below)
+        dt = times[index[rows]] - times[index[rows] - 1]
+        latencies[rows] = times[index[rows] - 1] + frac * dt
+    return PhotodiodeLatencies(latencies, thresholds, medians, valid, index)
+
+
+def correct_events(events, latencies, sfreq, unit="s", fallback=None):
+    """Shift MNE events by their photodiode latencies.
+
+    Parameters
+    ----------
+    events : ndarray, shape (n_events, 3)
+        MNE events; column 0 is the sample.
+    latencies : array-like, shape (n_events,)
+        Latency of each event, NaN or None where it is missing.
+    sfreq : float
+        Sampling frequency of the recording the events index into.
+    unit : 's' | 'ms'
+        Unit of latencies (and of a numeric fallback).
+    fallback : None | 'median' | float
+        What to do with missing latencies: None drops those events, 'median'
+        uses the median of the valid latencies, and a number uses that fixed
+        latency (e.g. the rig median from batch_latencies).
+
+    Returns
+    -------
+    corrected : ndarray, shape (n_kept, 3)
+        Copy of the kept events with the latency added to column 0, in samples.
+    keep : ndarray of bool, shape (n_events,)
+        Which input events were kept.
+    """
+    events = np.asarray(events)
+    latencies = np.array(latencies, dtype=np.float64)
+    if len(latencies) != len(events):
+        raise ValueError(f"Got {len(latencies)} latencies for {len(events)} events")
+    scale = {"s": 1.0, "ms": 1e-3}[unit]
+    missing = np.isnan(latencies)
+    if fallback is not None and missing.any():
+        fill = np.median(latencies[~missing]) if fallback == "median" else fallback
+        latencies[missing] = fill
+        missing = np.isnan(latencies)
+    keep = ~missing
+    corrected = events[keep].copy()
+    corrected[:, 0] += np.round(latencies[keep] * scale * sfreq).astype(corrected.dtype)
+    return corrected, keep
+
+
+PhotodiodeOnsets = namedtuple("PhotodiodeOnsets", ["markers", "onsets", "latencies", "thresholds", "valid"])
+PhotodiodeOnsets.__doc__ = """Result of stream_onsets, one entry per stimulus marker.
+
+markers are the MARKER_DTYPE rows from the .vmrk, onsets the detected onset
+samples (-1 where invalid), latencies the onset minus marker in seconds."""
+
+
+def stream_onsets(vhdr, channel=None, pattern=r"s\d+", tmin=0.0, tmax=0.5, h_freq=40.0,
+                  mad_factor=4, chunk_s=60.0):
+    """Detect the photodiode onset after every stimulus marker of a recording.
+
+    Reads only the photodiode channel from the .eeg, chunk_s seconds at a
+    time, and filters it with a causal linear-phase FIR whose state carries
+    across chunks. The FIR delay is a whole number of samples and is removed,
+    so onsets match a zero-phase filter like raw.filter(None, 40). After the
+    last chunk the filter is flushed with the last sample held, so markers
+    near the end of the recording are measured too. Memory is bounded by the
+    chunk size and the epoch window, not the recording length.
+
+    Parameters
+    ----------
+    vhdr : str
+        BrainVision header file.
+    channel : str | None
+        Photodiode channel. Defaults to the only channel of a photodiode-only
+        recording, or to EKG. Required when there are several channels and
+        none is called EKG.
+    pattern : str
+        Regex that Stimulus marker descriptions must match (e.g. 's2').
+    tmin, tmax : float
+        Search window after each marker, in seconds.
+    h_freq : float | None
+        Low-pass cutoff in Hz; None skips filtering.
+    mad_factor : float
+        Threshold in MADs above the median, as in detect_latencies.
+    chunk_s : float
+        Seconds read from disk at a time.
+
+    Returns
+    -------
+    PhotodiodeOnsets
+    """
+    header = brainvision.read_header(vhdr)
+    if channel is None:
+        if header.n_channels == 1:
+            channel = header.ch_names[0]
+        elif "EKG" in header.ch_names:
+            channel = "EKG"
+        else:
+            raise ValueError(f"{vhdr} has no EKG channel; pass channel= one of {', '.join(header.ch_names)}")
+    markers = brainvision.stimulus_markers(brainvision.read_markers(header.marker_file), pattern)
+    sfreq = header.sfreq
+    first = int(round(tmin * sfreq))
+    n_times = int(round((tmax - tmin) * sfreq)) + 1
+    times = first / sfreq + np.arange(n_times) / sfreq
+    starts = markers["sample"] + first
+
+    if h_freq is None:
+        taps, delay = np.ones(1), 0
+    else:
+        taps = design_kernel(sfreq, None, float(h_freq))
+        delay = (len(taps) - 1) // 2
+    zi = None
+
+    n = len(markers)
+    onsets = np.full(n, -1, dtype=np.int64)
+    latencies = np.full(n, np.nan)
+    thresholds = np.full(n, np.nan)
+    valid = np.zeros(n, dtype=bool)
+
+    # buf holds filtered samples, already shifted back by the FIR delay:
+    # buf[i] is sample buf_start + i of the recording
+    buf = np.empty(0)
+    buf_start = -delay
+    next_marker = int(np.searchsorted(starts, 0))
+    chunks = brainvision.iter_channel_chunks(header, channel, int(chunk_s * sfreq))
+    tail = None
+    while next_marker < n:
+        data = next(chunks, None)
+        if data is None:
+            if tail is None or delay == 0:
+                break
+            # Flush the last `delay` samples out of the filter, holding the
+            # last value as the first one primes it
+            data = np.full(delay, tail)
+            delay = 0
+        else:
+            data = data[1]
+            tail = data[-1]
+        if zi is None:
+            zi = lfilter_zi(taps, 1.0) * data[0]
+        filtered, zi = lfilter(taps, 1.0, data, zi=zi)
+        buf = np.concatenate([buf, filtered])
+        buf_end = buf_start + len(buf)
+
+        # All markers whose window is complete in this chunk, in one call
+        done = next_marker + int(np.searchsorted(starts[next_marker:] + n_times, buf_end, side="right"))
+        if done > next_marker:
+            rows = np.arange(next_marker, done)
+            idx = (starts[rows] - buf_start)[:, None] + np.arange(n_times)
+            found = detect_latencies(buf[idx], times, mad_factor)
+            onsets[rows] = np.where(found.valid, starts[rows] + found.index, -1)
+            latencies[rows] = found.latencies
+            thresholds[rows] = found.thresholds
+            valid[rows] = found.valid
+            next_marker = done
+
+        # Keep only what pending windows still need
+        keep_from = starts[next_marker] if next_marker < n else buf_end
+        drop = int(np.clip(keep_from - buf_start, 0, len(buf)))
+        buf = buf[drop:]
+        buf_start += drop
+    return PhotodiodeOnsets(markers, onsets, latencies, thresholds, valid)
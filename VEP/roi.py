@@ -0,0 +1,158 @@
+"""Region-of-interest VEP waveforms and headless figure export.
+
+combine_rois averages the channels of every ROI for every condition in one
+matrix product and keeps the result (RoiWaveforms), which can be saved to and
+loaded from an .npz. export_figures then renders all comparison figures from
+those arrays on Agg canvases in a thread pool, instead of calling
+plot_compare_evokeds (and re-combining channels) once per interactive figure.
+Figures are built without pyplot, so no windows open and workers don't share
+state; threads rather than processes keep it safe to call from the
+unguarded top level of the analysis scripts.
+
+The analysis scripts save their ROI waveforms next to the figures, so the
+figure set can be redrawn from that file without rerunning the pipeline:
+
+    python roi.py "VEP Data/AJK-03-01-24_rois.npz" "VEP Data"
+"""
+import argparse
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_ROIS = OrderedDict([
+    ("Occipital", ["O1", "O2", "Oz", "POz", "PO3", "PO4", "PO5", "PO6", "PO7", "PO8"]),
+    ("Occipital_3", ["POz", "O1", "O2"]),
+    ("POz", ["POz"]),
+])
+
+RoiWaveforms = namedtuple("RoiWaveforms", ["times", "conditions", "rois", "data", "n_channels"])
+RoiWaveforms.__doc__ = """ROI-combined evoked data.
+
+data has shape (n_conditions, n_rois, n_times) in volts; n_channels is how
+many of each ROI's channels were present and averaged."""
+
+
+def combine_rois(evokeds, rois=DEFAULT_ROIS):
+    """Mean waveform of each ROI for each condition.
+
+    Parameters
+    ----------
+    evokeds : dict
+        Condition name -> mne.Evoked; all must share channels and times.
+    rois : dict
+        ROI name -> list of channel names. Channels missing from the data are
+        ignored; ROIs with none present are dropped.
+
+    Returns
+    -------
+    RoiWaveforms
+    """
+    conditions = list(evokeds)
+    first = evokeds[conditions[0]]
+    ch_names = list(first.ch_names)
+    names, weights, counts = [], [], []
+    for name, channels in rois.items():
+        idx = [ch_names.index(ch) for ch in channels if ch in ch_names]
+        if not idx:
+            continue
+        row = np.zeros(len(ch_names))
+        row[idx] = 1.0 / len(idx)
+        names.append(name)
+        weights.append(row)
+        counts.append(len(idx))
+    data = np.stack([evokeds[c].data for c in conditions])
+    combined = np.einsum("rc,kct->krt", np.array(weights), data)
+    return RoiWaveforms(np.asarray(first.times), conditions, names, combined, np.array(counts))
+
+
+def save_rois(fname, waveforms):
+    """Save RoiWaveforms to an .npz (see load_rois)."""
+    np.savez(fname, times=waveforms.times, conditions=np.array(waveforms.conditions),
+             rois=np.array(waveforms.rois), data=waveforms.data, n_channels=waveforms.n_channels)
+
+
+def load_rois(fname):
+    with np.load(fname) as f:
+        return RoiWaveforms(f["times"], f["conditions"].tolist(), f["rois"].tolist(), f["data"], f["n_channels"])
+
+
+def _render(job):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fname, title, times_ms, traces = job
+    fig = Figure(figsize=(8, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    for label, color, trace in traces:
+        ax.plot(times_ms, trace * 1e6, label=label, color=color)
+    ax.axvline(0, color="black", linestyle="--", linewidth=0.8)
+    ax.axhline(0, color="gray", linewidth=0.5)
+    ax.set_xlabel("Time (ms)")
+    ax.set_ylabel("Amplitude (µV)")
+    ax.set_title(title)
+    ax.legend()
+    fig.savefig(fname)
+    return fname
+
+
+def export_figures(waveforms, out_dir, figures=None, colors=None, prefix="VEP", fmt="png", n_jobs=None):
+    """Render ROI comparison figures to files without opening any windows.
+
+    Parameters
+    ----------
+    waveforms : RoiWaveforms
+    out_dir : str
+    figures : list of (roi, conditions) or (roi, conditions, name) | None
+        One figure per entry, overlaying the given conditions for that ROI,
+        written to <name>.<fmt> when a name is given. Default: every ROI
+        with all conditions.
+    colors : dict | None
+        Condition name -> matplotlib color.
+    prefix, fmt : str
+        Unnamed figures are written to <prefix>_<roi>.<fmt>, plus the
+        conditions when a figure shows a subset of them.
+    n_jobs : int | None
+        Worker threads (default: ThreadPoolExecutor's).
+
+    Returns
+    -------
+    list of str
+        The written files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    colors = colors or {}
+    if figures is None:
+        figures = [(roi, waveforms.conditions) for roi in waveforms.rois]
+    times_ms = waveforms.times * 1e3
+    jobs = []
+    for roi, conditions, *name in figures:
+        r = waveforms.rois.index(roi)
+        traces = [(c, colors.get(c), waveforms.data[waveforms.conditions.index(c), r]) for c in conditions]
+        if name:
+            name = name[0]
+        else:
+            name = f"{prefix}_{roi}"
+            if list(conditions) != list(waveforms.conditions):
+                name += "_" + "_".join(conditions)
+        title = f"{roi} (mean of {waveforms.n_channels[r]} channels)"
+        jobs.append((os.path.join(out_dir, f"{name}.{fmt}"), title, times_ms, traces))
+    with ThreadPoolExecutor(n_jobs) as pool:
+        return list(pool.map(_render, jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redraw ROI figures from a save_rois file.")
+    parser.add_argument("rois", help=".npz written by save_rois")
+    parser.add_argument("out_dir")
+    parser.add_argument("--prefix", default="VEP")
+    parser.add_argument("--fmt", default="png")
+    args = parser.parse_args()
+    for fname in export_figures(load_rois(args.rois), args.out_dir, prefix=args.prefix, fmt=args.fmt):
+        print(fname)
+
+
+if __name__ == "__main__":
+    main()
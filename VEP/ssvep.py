@@ -0,0 +1,186 @@
+"""Steady-state VEP spectra and SNR from checkerboard blocks.
+
+The checkerboard reverses check_freq times per second, so during each
+checkerboard block the EEG carries a steady-state response at check_freq and
+its harmonics. welch_blocks cuts every Welch segment of every block out of a
+strided view of the continuous (n_times, n_channels) data, and computes all
+of their spectra in one batched FFT. snr_at compares the power at each
+target frequency with the mean of the neighbouring bins.
+
+    python ssvep.py recording.vhdr --check-freq 1 --block-s 2
+"""
+import argparse
+from collections import namedtuple
+
+import numpy as np
+import scipy.fft
+from scipy.signal import get_window
+
+from brainvision import BrainVisionReader, stimulus_markers
+
+SsvepResult = namedtuple("SsvepResult", ["freqs", "psd", "targets", "snr", "channels", "block_starts"])
+SsvepResult.__doc__ = """Result of ssvep_session.
+
+psd has shape (n_blocks, n_channels, n_freqs) in V**2/Hz; snr has shape
+(n_blocks, n_channels, n_targets), for the target frequencies in targets."""
+
+
+def welch_blocks(data, starts, n_times, sfreq, nperseg=None, noverlap=None, window="hann"):
+    """Welch power spectral density of every channel in every block.
+
+    Parameters
+    ----------
+    data : array, shape (n_samples, n_channels)
+        Continuous data, e.g. BrainVisionReader.get(picks); not copied.
+    starts : array of int, shape (n_blocks,)
+        First sample of each block.
+    n_times : int
+        Block length in samples.
+    sfreq : float
+    nperseg : int | None
+        Welch segment length (default: the whole block, a periodogram).
+    noverlap : int | None
+        Segment overlap (default: half a segment).
+    window : str
+        Taper, as for scipy.signal.get_window.
+
+    Returns
+    -------
+    freqs : ndarray, shape (n_freqs,)
+    psd : ndarray, shape (n_blocks, n_channels, n_freqs)
+        Matches scipy.signal.welch on each block (constant detrend, density).
+    """
+    nperseg = n_times if nperseg is None else min(nperseg, n_times)
+    noverlap = nperseg // 2 if noverlap is None else noverlap
+    step = nperseg - noverlap
+    offsets = np.arange(0, n_times - nperseg + 1, step)
+    seg_starts = np.asarray(starts, dtype=np.int64)[:, None] + offsets
+
+    # (n_samples - nperseg + 1, n_channels, nperseg) view; only the segments are gathered
+    windows = np.lib.stride_tricks.sliding_window_view(data, nperseg, axis=0)
+    segments = windows[seg_starts].astype(np.float64)
+    segments -= segments.mean(axis=-1, keepdims=True)
+    taper = get_window(window, nperseg)
+    segments *= taper
+    spectra = scipy.fft.rfft(segments, axis=-1, workers=-1)
+    psd = (spectra.real ** 2 + spectra.imag ** 2).mean(axis=1)
+    psd /= sfreq * (taper ** 2).sum()
+    # One-sided: double everything but DC and (for even nperseg) Nyquist
+    psd[..., 1:psd.shape[-1] - (nperseg % 2 == 0)] *= 2
+    return scipy.fft.rfftfreq(nperseg, 1 / sfreq), psd
+
+
+def snr_at(freqs, psd, targets, n_neighbors=3, skip=1, min_neighbors=None):
+    """Power at each target bin over the mean of n_neighbors bins on either side.
+
+    skip bins next to the target are left out of the noise estimate, and so
+    are neighbours outside the spectrum and the DC and last (Nyquist) bins,
+    which detrending and the one-sided scaling make unlike the noise floor.
+    Returns an array shaped psd.shape[:-1] + (len(targets),).
+
+    Raises ValueError if a target is outside the spectrum or has fewer than
+    min_neighbors (default: n_neighbors) noise bins left.
+    """
+    min_neighbors = n_neighbors if min_neighbors is None else min_neighbors
+    df = freqs[1] - freqs[0]
+    bins = np.round(np.asarray(targets) / df).astype(int)
+    if np.any((bins < 1) | (bins > len(freqs) - 2)):
+        raise ValueError(f"Targets {targets} are not all inside (0, {freqs[-1]:g}) Hz")
+    side = np.arange(skip + 1, skip + 1 + n_neighbors)
+    neighbors = bins[:, None] + np.concatenate([-side, side])
+    usable = (neighbors >= 1) & (neighbors <= len(freqs) - 2)
+    n_usable = usable.sum(axis=1)
+    if np.any(n_usable < min_neighbors):
+        bad = np.asarray(targets)[n_usable < min_neighbors]
+        raise ValueError(f"Too few noise bins around {bad} Hz at {df:g} Hz resolution; "
+                         f"use longer blocks or fewer neighbours")
+    noise = (psd[..., np.where(usable, neighbors, 0)] * usable).sum(axis=-1) / n_usable
+    return psd[..., bins] / noise
+
+
+def white_noise_snr(sfreq=500.0, block_s=2.0, targets=(1.0, 2.0, 3.0), n_blocks=400, n_channels=8,
+                    nperseg=None, seed=0):
+    """SNR of the block-averaged spectrum of white noise; should be ~1 at every target.
+
+    A check on snr_at's noise estimate at the given block length and
+    resolution. Returns an array of shape (n_channels, n_targets).
+    """
+    rng = np.random.default_rng(seed)
+    n_times = int(round(block_s * sfreq))
+    data = rng.standard_normal((n_blocks * n_times, n_channels))
+    freqs, psd = welch_blocks(data, np.arange(n_blocks) * n_times, n_times, sfreq, nperseg)
+    return snr_at(freqs, psd.mean(axis=0), targets)
+
+
+def ssvep_session(vhdr, check_freq=1.0, block_s=2.0, marker="s2", align="end", picks=None,
+                  n_harmonics=3, nperseg=None, n_neighbors=3):
+    """Spectra and SNR for every checkerboard block of a BrainVision recording.
+
+    Parameters
+    ----------
+    vhdr : str
+    check_freq : float
+        Checkerboard reversal rate in Hz; targets are its first n_harmonics multiples.
+    block_s : float
+        Checkerboard block duration in seconds.
+    marker : str
+        Stimulus marker description of each block (regex).
+    align : 'end' | 'start'
+        Whether the marker ends the block (checkerboard_end in VEP_07-06-24)
+        or starts it.
+    picks : list of str | None
+        Channels (default: all).
+
+    Returns
+    -------
+    SsvepResult
+    """
+    reader = BrainVisionReader(vhdr)
+    sfreq = reader.sfreq
+    n_times = int(round(block_s * sfreq))
+    samples = stimulus_markers(reader.markers, marker)["sample"]
+    starts = samples - n_times if align == "end" else samples
+    starts = starts[(starts >= 0) & (starts + n_times <= reader.n_times)]
+    idx = reader.pick(picks)
+
+    freqs, psd = welch_blocks(reader.get(picks), starts, n_times, sfreq, nperseg)
+    psd *= reader.header.scales[idx][:, None] ** 2
+    targets = check_freq * np.arange(1, n_harmonics + 1)
+    targets = targets[targets < sfreq / 2]
+    snr = snr_at(freqs, psd, targets, n_neighbors)
+    return SsvepResult(freqs, psd, targets, snr, [reader.ch_names[i] for i in idx], starts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("vhdr", nargs="?")
+    parser.add_argument("--check-freq", type=float, default=1.0)
+    parser.add_argument("--block-s", type=float, default=2.0)
+    parser.add_argument("--marker", default="s2")
+    parser.add_argument("--align", choices=["end", "start"], default="end")
+    parser.add_argument("--picks", nargs="+")
+    parser.add_argument("--harmonics", type=int, default=3)
+    parser.add_argument("--white-noise", action="store_true",
+                        help="Only check that white noise gives SNR ~1 at these settings")
+    args = parser.parse_args()
+
+    if args.white_noise:
+        targets = args.check_freq * np.arange(1, args.harmonics + 1)
+        snr = white_noise_snr(block_s=args.block_s, targets=targets).mean(axis=0)
+        print(", ".join(f"{f:g} Hz: {x:.2f}" for f, x in zip(targets, snr)))
+        return
+    if args.vhdr is None:
+        parser.error("vhdr is required unless --white-noise is given")
+
+    result = ssvep_session(args.vhdr, args.check_freq, args.block_s, args.marker, args.align, args.picks,
+                           args.harmonics)
+    # SNR of the block-averaged spectrum; a mean of per-block ratios is biased upward
+    mean_snr = snr_at(result.freqs, result.psd.mean(axis=0), result.targets)
+    print(f"{len(result.block_starts)} blocks, {len(result.channels)} channels")
+    for f, column in zip(result.targets, mean_snr.T):
+        best = np.argsort(column)[::-1][:5]
+        print(f"{f:g} Hz: " + ", ".join(f"{result.channels[i]} {column[i]:.2f}" for i in best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+
+# Position/color arrays are cached here between runs
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".stimulus_cache")
+
+
+def phase_count(check_freq):
+    """Number of distinct phase states the stimulus loop cycles through.
+
+    Matches the modulus the stimulus scripts used: 2 for check_freq >= 1 Hz,
+    4 for 0.5 Hz.
+    """
+    return 4 if check_freq < 1 else 2
+
+
+def checker_positions(num_squares, check_size):
+    """Element centres of a num_squares x num_squares grid, in pixels.
+
+    Same ordering as the old list comprehension (x outer, y inner).
+    """
+    offsets = (np.arange(num_squares) - num_squares // 2) * check_size
+    xys = np.empty((num_squares * num_squares, 2), dtype=np.float64)
+    xys[:, 0] = np.repeat(offsets, num_squares)
+    xys[:, 1] = np.tile(offsets, num_squares)
+    return xys
+
+
+def checker_colors(num_squares, phase):
+    """RGB colors for one phase: black where (x + y + phase) is even, else white."""
+    idx = np.arange(num_squares)
+    parity = (idx[:, None] + idx[None, :] + phase) % 2
+    colors = np.where(parity.reshape(-1, 1) == 0, -1.0, 1.0)
+    return np.ascontiguousarray(np.broadcast_to(colors, (num_squares * num_squares, 3)))
+
+
+def checker_phase_colors(num_squares, n_phases):
+    """Color arrays for every phase, built once. Phases with equal parity share an array."""
+    by_parity = [checker_colors(num_squares, p) for p in range(2)]
+    return [by_parity[p % 2] for p in range(n_phases)]
+
+
+def load_checker_arrays(num_squares, check_size, n_phases, cache_dir=CACHE_DIR):
+    """Positions and per-phase colors, read from cache_dir if built before.
+
+    Pass cache_dir=None to always rebuild.
+    """
+    fname = None
+    if cache_dir is not None:
+        fname = os.path.join(cache_dir, f"checker_{num_squares}_{check_size}.npz")
+        try:
+            with np.load(fname) as f:
+                by_parity = [f["colors0"], f["colors1"]]
+                return f["xys"], [by_parity[p % 2] for p in range(n_phases)]
+        except (OSError, KeyError, ValueError):
+            pass
+    xys = checker_positions(num_squares, check_size)
+    colors = checker_phase_colors(num_squares, n_phases)
+    if fname is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(fname, xys=xys, colors0=colors[0], colors1=colors[1])
+    return xys, colors
+
+
+class CheckerboardStim:
+    """Phase-reversing checkerboard with every phase state built up front.
+
+    Each phase gets its own ElementArrayStim, so the render loop only picks
+    which one to draw; no color lists are rebuilt or re-uploaded per frame.
+
+    Parameters
+    ----------
+    win : psychopy.visual.Window
+        Window to draw into (units='pix').
+    num_squares : int
+        Squares per side.
+    check_size : int
+        Square size in pixels.
+    check_freq : float
+        Reversal frequency in Hz.
+    n_phases : int | None
+        Number of phase states; defaults to phase_count(check_freq).
+    cache_dir : str | None
+        Where position/color arrays are cached between runs.
+    """
+
+    def __init__(self, win, num_squares=260, check_size=20, check_freq=1, n_phases=None, cache_dir=CACHE_DIR):
+        from psychopy import visual
+
+        self.win = win
+        self.num_squares = num_squares
+        self.check_size = check_size
+        self.check_freq = check_freq
+        self.n_phases = n_phases or phase_count(check_freq)
+
+        xys, colors = load_checker_arrays(num_squares, check_size, self.n_phases, cache_dir)
+        stims = {}
+        self.phases = []
+        for colors_p in colors:
+            key = id(colors_p)
+            if key not in stims:
+                stims[key] = visual.ElementArrayStim(
+                    win, nElements=num_squares ** 2, sizes=(check_size, check_size), xys=xys,
+                    elementTex=None, elementMask=None, colors=colors_p, colorSpace='rgb')
+            self.phases.append(stims[key])
+
+    def phase_at(self, t):
+        """Phase index for t seconds into a checkerboard block."""
+        return int(t * self.check_freq) % self.n_phases
+
+    def draw(self, t):
+        """Draw the phase state for t seconds into the block."""
+        self.phases[self.phase_at(t)].draw()
+
+    def draw_phase(self, phase):
+        self.phases[phase % self.n_phases].draw()
@@ -0,0 +1,164 @@
+"""Benchmark the checkerboard stimulus hot loop without the stimulus display.
+
+Compares the old per-frame list rebuild ("legacy") against the precomputed
+phase states in checkerboard.py ("precomputed") for a range of num_squares
+and check_size values. Per-frame CPU time is split into color generation,
+upload (handing colors to the stimulus) and draw.
+
+--draw stub (default) replaces the draw calls with no-ops and, for legacy,
+emulates the upload with the same array conversion PsychoPy's colors setter
+does, so it runs on any machine. --draw window renders into a small
+non-fullscreen PsychoPy window; on a headless Linux box run it under a
+software-GL X server, e.g. xvfb-run python checkerboard_bench.py --draw window
+
+    python checkerboard_bench.py --num-squares 65 130 260 --check-size 10 20
+"""
+import argparse
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+
+from checkerboard import checker_phase_colors, phase_count
+
+
+def legacy_colors(num_squares, phase):
+    # The per-frame list comprehension the stimulus scripts used
+    return [[-1, -1, -1] if (x + y + phase) % 2 == 0 else [1, 1, 1]
+            for x in range(num_squares) for y in range(num_squares)]
+
+
+class _StubStim:
+    def __init__(self):
+        self.colors = None
+
+    def draw(self):
+        pass
+
+
+class _StubTarget:
+    """Draw/upload targets with the draw calls stubbed out."""
+
+    def __init__(self, num_squares, check_size, n_phases):
+        self.legacy = _StubStim()
+        self.phases = [_StubStim() for _ in range(n_phases)]
+
+    def upload(self, colors):
+        self.legacy.colors = np.array(colors, dtype=float).reshape(-1, 3)
+
+    def close(self):
+        pass
+
+
+class _WindowTarget:
+    """Real PsychoPy stimuli in a small window (needs an X display or xvfb)."""
+
+    def __init__(self, num_squares, check_size, n_phases):
+        from psychopy import visual
+        from checkerboard import CheckerboardStim, checker_positions
+
+        self.win = visual.Window(size=(640, 480), fullscr=False, units='pix', color='black',
+                                 waitBlanking=False, allowGUI=False)
+        self.legacy = visual.ElementArrayStim(
+            self.win, nElements=num_squares ** 2, sizes=(check_size, check_size),
+            xys=checker_positions(num_squares, check_size), elementTex=None, elementMask=None,
+            colors=legacy_colors(num_squares, 0), colorSpace='rgb')
+        self.phases = CheckerboardStim(self.win, num_squares, check_size, n_phases=n_phases).phases
+
+    def upload(self, colors):
+        self.legacy.colors = colors
+
+    def close(self):
+        self.win.close()
+
+
+def _run_frames(target, mode, num_squares, n_phases, n_frames, phase_colors, timings=None, keep=None):
+    for frame in range(n_frames):
+        phase = frame % n_phases
+        t0 = perf_counter()
+        if mode == "legacy":
+            colors = legacy_colors(num_squares, phase)
+        else:
+            colors = phase_colors[phase]
+        t1 = perf_counter()
+        if mode == "legacy":
+            target.upload(colors)
+            stim = target.legacy
+        else:
+            stim = target.phases[phase]
+        t2 = perf_counter()
+        stim.draw()
+        t3 = perf_counter()
+        if timings is not None:
+            timings[frame] = (t1 - t0, t2 - t1, t3 - t2)
+        if keep is not None:
+            # Hold on to what the frame created so tracemalloc sees it as live
+            keep.append((colors, getattr(stim, "colors", None)))
+
+
+def bench(num_squares, check_size, mode, n_frames=60, draw="stub", check_freq=1):
+    """Time n_frames of one configuration.
+
+    Returns a dict with fps, mean per-frame milliseconds for each stage, and
+    Python allocations per frame (counted in a separate tracemalloc pass so
+    tracing does not distort the timings; peak_kb is that pass's peak).
+    """
+    n_phases = phase_count(check_freq)
+    target_cls = _WindowTarget if draw == "window" else _StubTarget
+    target = target_cls(num_squares, check_size, n_phases)
+    phase_colors = checker_phase_colors(num_squares, n_phases)
+    try:
+        timings = np.zeros((n_frames, 3))
+        _run_frames(target, mode, num_squares, n_phases, 2, phase_colors)  # warm up
+        _run_frames(target, mode, num_squares, n_phases, n_frames, phase_colors, timings)
+
+        n_alloc_frames = min(n_frames, 10)
+        tracemalloc.start()
+        keep = []
+        before = tracemalloc.take_snapshot()
+        _run_frames(target, mode, num_squares, n_phases, n_alloc_frames, phase_colors, keep=keep)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del keep
+    finally:
+        target.close()
+
+    allocs = sum(max(0, s.count_diff) for s in after.compare_to(before, "lineno"))
+    gen_ms, upload_ms, draw_ms = timings.mean(axis=0) * 1e3
+    return {
+        "mode": mode,
+        "num_squares": num_squares,
+        "check_size": check_size,
+        "fps": 1e3 / (gen_ms + upload_ms + draw_ms),
+        "gen_ms": gen_ms,
+        "upload_ms": upload_ms,
+        "draw_ms": draw_ms,
+        "allocs_per_frame": allocs / n_alloc_frames,
+        "peak_kb": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-squares", type=int, nargs="+", default=[65, 130, 260])
+    parser.add_argument("--check-size", type=int, nargs="+", default=[20])
+    parser.add_argument("--modes", nargs="+", default=["legacy", "precomputed"], choices=["legacy", "precomputed"])
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--draw", default="stub", choices=["stub", "window"])
+    parser.add_argument("--check-freq", type=float, default=1)
+    args = parser.parse_args()
+
+    header = f"{'mode':<12}{'squares':>8}{'size':>6}{'fps':>10}{'gen ms':>9}{'upload ms':>11}{'draw ms':>9}{'allocs/fr':>11}{'peak KB':>10}"
+    print(header)
+    for num_squares in args.num_squares:
+        for check_size in args.check_size:
+            for mode in args.modes:
+                r = bench(num_squares, check_size, mode, args.frames, args.draw, args.check_freq)
+                print(f"{r['mode']:<12}{r['num_squares']:>8}{r['check_size']:>6}{r['fps']:>10.1f}"
+                      f"{r['gen_ms']:>9.3f}{r['upload_ms']:>11.3f}{r['draw_ms']:>9.3f}"
+                      f"{r['allocs_per_frame']:>11.1f}{r['peak_kb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Clock offset/drift between the stimulus PC and the Kernel acquisition host.
+
+ClockSync sends clock_ping events over an EventSender's socket and expects
+the host to answer with clock_pong frames carrying its receive (t1) and send
+(t2) times, as kernel_stand_in does. For each round trip
+
+    offset = ((t1 - t0) + (t2 - t3)) / 2      delay = (t3 - t0) - (t2 - t1)
+
+where t0/t3 are local send/receive times. Round trips with a short delay
+give the most accurate offsets, so the model is a straight-line fit of
+offset against local time over the fastest half of the recent samples:
+host = local + offset_us + drift * (local - t_ref_us).
+
+match_onsets (used by kernel_snirf.read_events and align_stim_groups) then
+replaces the host's SNIRF stim onsets with the logged local send times
+mapped onto the host clock, pairing events by stim group and nearest time.
+
+Only enable this against a host that answers pings; a host that does not
+will just record clock_ping as an ordinary event.
+"""
+import threading
+import warnings
+from collections import deque, namedtuple
+
+import numpy as np
+
+ClockModel = namedtuple("ClockModel", ["t_ref_us", "offset_us", "drift", "n_samples"])
+ClockModel.__doc__ = """Linear clock model: host = local + offset_us + drift * (local - t_ref_us)."""
+
+
+def to_host(model, local_us):
+    """Map local timestamps (us) onto the host clock."""
+    local_us = np.asarray(local_us, dtype=np.float64)
+    return local_us + model.offset_us + model.drift * (local_us - model.t_ref_us)
+
+
+def to_local(model, host_us):
+    """Inverse of to_host."""
+    host_us = np.asarray(host_us, dtype=np.float64)
+    return (host_us - model.offset_us + model.drift * model.t_ref_us) / (1 + model.drift)
+
+
+def fit_clock_model(samples, best_fraction=0.5):
+    """Fit a ClockModel to (local_mid_us, offset_us, delay_us) samples.
+
+    Keeps the best_fraction of samples with the smallest round-trip delay;
+    fits drift only when those span more than one distinct time.
+    """
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1, 3)
+    if len(samples) == 0:
+        return None
+    keep = samples[:, 2] <= np.quantile(samples[:, 2], best_fraction)
+    t, offset = samples[keep, 0], samples[keep, 1]
+    t_ref = float(t.mean())
+    if len(t) >= 3 and np.ptp(t) > 0:
+        drift, offset_ref = np.polyfit(t - t_ref, offset, 1)
+    else:
+        drift, offset_ref = 0.0, float(np.median(offset))
+    return ClockModel(t_ref, float(offset_ref), float(drift), int(keep.sum()))
+
+
+class ClockSync:
+    """Estimate offset and drift to the event host in the background.
+
+    Parameters
+    ----------
+    sender : EventSender
+        Its socket carries the pings; ClockSync installs itself as on_reply.
+    interval : float
+        Seconds between pings.
+    window : int
+        Most recent round trips kept for the fit.
+    """
+
+    def __init__(self, sender, interval=1.0, window=120):
+        self.sender = sender
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.history = []
+        self.model = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="clock-sync", daemon=True)
+        sender.on_reply = self.handle_reply
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(self.interval + 1)
+
+    def handle_reply(self, frame, recv_us):
+        if frame.get("event") != "clock_pong":
+            return
+        t0, t1, t2, t3 = frame["t0"], frame["t1"], frame["t2"], recv_us
+        sample = ((t0 + t3) / 2, ((t1 - t0) + (t2 - t3)) / 2, (t3 - t0) - (t2 - t1))
+        with self._lock:
+            self.samples.append(sample)
+            self.history.append(sample)
+            self.model = fit_clock_model(self.samples)
+
+    def save(self, fname):
+        """Save every round trip (local_mid_us, offset_us, delay_us) for offline fitting."""
+        with self._lock:
+            np.save(fname, np.asarray(self.history, dtype=np.float64).reshape(-1, 3))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._seq += 1
+            self.sender.send_ping(self._seq)
+
+
+def stim_group_name(event_name):
+    """Kernel stim group name for an event name, e.g. start_blank_screen -> StartBlankScreen."""
+    return "".join(word.capitalize() for word in event_name.split("_"))
+
+
+def match_onsets(onsets, names, event_log, model, host_start_us, max_shift=0.5):
+    """Clock-corrected onsets for SNIRF events, matched to the local event log.
+
+    Each SNIRF event is paired with the logged event of the same stim group
+    whose host-mapped time is closest to it, so replayed batches, aborted
+    runs and events missing from either side do not shift the pairing.
+    Each logged event is used at most once.
+
+    Parameters
+    ----------
+    onsets : array, shape (n_events,)
+        Onsets in seconds from recording start, as written by the host.
+    names : array of str, shape (n_events,)
+        Stim group name of each event.
+    event_log : list
+        EventSender.log entries (id, timestamp_us, name, value).
+    model : ClockModel
+    host_start_us : float
+        Recording start on the host clock, in microseconds.
+    max_shift : float
+        Largest distance in seconds between a SNIRF onset and its logged event.
+
+    Returns
+    -------
+    aligned : ndarray, shape (n_events,)
+        Logged local times mapped onto the host clock, in seconds from
+        recording start; the original onset where no event matched.
+    matched : ndarray of bool, shape (n_events,)
+    """
+    onsets = np.asarray(onsets, dtype=np.float64)
+    names = np.asarray(names)
+    aligned = onsets.copy()
+    matched = np.zeros(len(onsets), dtype=bool)
+    log_names = np.array([stim_group_name(name) for _, _, name, _ in event_log])
+    log_times = np.array([timestamp for _, timestamp, _, _ in event_log], dtype=np.float64)
+    if len(log_times):
+        log_times = (to_host(model, log_times) - host_start_us) / 1e6
+    for name in np.unique(names):
+        rows = np.flatnonzero(names == name)
+        times = np.sort(log_times[log_names == name])
+        if len(times) == 0:
+            continue
+        # Nearest logged event on either side of each onset
+        right = np.minimum(np.searchsorted(times, onsets[rows]), len(times) - 1)
+        left = np.maximum(right - 1, 0)
+        nearest = np.where(np.abs(times[left] - onsets[rows]) <= np.abs(times[right] - onsets[rows]), left, right)
+        distance = np.abs(times[nearest] - onsets[rows])
+        # Closest pairs first; each logged event is taken once
+        order = np.argsort(distance, kind="stable")
+        _, first = np.unique(nearest[order], return_index=True)
+        ok = np.zeros(len(rows), dtype=bool)
+        ok[order[first]] = True
+        ok &= distance <= max_shift
+        aligned[rows[ok]] = times[nearest[ok]]
+        matched[rows[ok]] = True
+    return aligned, matched
+
+
+def align_stim_groups(stims, event_log, model, host_start_us, max_shift=0.5):
+    """Replace SNIRF stim onsets with clock-corrected local event times.
+
+    Parameters
+    ----------
+    stims : dict
+        Stim group name -> data array (n_events, n_cols), onset in column 0,
+        as read from nirs/stim*/data.
+    event_log, model, host_start_us, max_shift
+        As for match_onsets.
+
+    Returns
+    -------
+    dict
+        Copies of the stim arrays with aligned onsets (seconds from recording
+        start). Events with no logged counterpart keep their onset, with a
+        warning.
+    """
+    aligned = {}
+    for name, data in stims.items():
+        data = np.array(data, dtype=np.float64, copy=True).reshape(len(data), -1)
+        data[:, 0], matched = match_onsets(data[:, 0], np.full(len(data), name), event_log, model,
+                                           host_start_us, max_shift)
+        if not matched.all():
+            warnings.warn(f"{name}: {(~matched).sum()} of {len(data)} events have no logged "
+                          f"counterpart and were left unaligned")
+        aligned[name] = data
+    return aligned
@@ -0,0 +1,105 @@
+import numpy as np
+
+FRAME_DTYPE = np.dtype([
+    ("block", np.int32),
+    ("frame", np.int32),
+    ("flip_time", np.float64),
+    ("interval", np.float32),
+    ("intended_phase", np.int8),
+    ("actual_phase", np.int8),
+    ("dropped", np.int16),
+    ("late", np.bool_),
+    ("event_id", np.int32),
+])
+
+
+class FrameTimer:
+    """Per-frame flip timing for the checkerboard blocks.
+
+    Records live in a preallocated ring buffer, so recording does no
+    allocation on the render thread. A frame counts as late when its flip
+    interval exceeds late_factor frame periods, and the number of refreshes
+    it skipped is stored as dropped.
+
+    Parameters
+    ----------
+    frame_period : float
+        Nominal refresh period in seconds (win.monitorFramePeriod).
+    capacity : int
+        Frames kept; older frames are overwritten once full.
+    late_factor : float
+        Interval, in frame periods, above which a flip is late.
+    """
+
+    def __init__(self, frame_period=1 / 60, capacity=1 << 18, late_factor=1.5):
+        self.frame_period = frame_period
+        self.late_factor = late_factor
+        self.frames = np.zeros(capacity, dtype=FRAME_DTYPE)
+        self.count = 0
+        self.block = -1
+        self.event_id = -1
+        self._frame = 0
+        self._last_flip = None
+
+    def start_block(self, block, event_id=-1):
+        """Start a new block, tagged with the id of the event that opened it."""
+        self.block = block
+        self.event_id = event_id
+        self._frame = 0
+
+    def record(self, flip_time, intended_phase, actual_phase):
+        """Store one flip. flip_time is the value returned by win.flip()."""
+        # The interval runs across block boundaries, so the onset flip of each
+        # block is checked too; only the first flip of the run has none (NaN).
+        if self._last_flip is None:
+            interval = np.nan
+            dropped = 0
+        else:
+            interval = flip_time - self._last_flip
+            dropped = max(0, round(interval / self.frame_period) - 1)
+        self._last_flip = flip_time
+        row = self.frames[self.count % len(self.frames)]
+        row["block"] = self.block
+        row["frame"] = self._frame
+        row["flip_time"] = flip_time
+        row["interval"] = interval
+        row["intended_phase"] = intended_phase
+        row["actual_phase"] = actual_phase
+        row["dropped"] = dropped
+        row["late"] = interval > self.late_factor * self.frame_period
+        row["event_id"] = self.event_id
+        self._frame += 1
+        self.count += 1
+
+    def data(self):
+        """Recorded frames in chronological order."""
+        n = len(self.frames)
+        if self.count <= n:
+            return self.frames[:self.count]
+        start = self.count % n
+        return np.concatenate([self.frames[start:], self.frames[:start]])
+
+    def summary(self):
+        frames = self.data()
+        return {
+            "frames": int(len(frames)),
+            "late": int(frames["late"].sum()),
+            "dropped": int(frames["dropped"].sum()),
+            "phase_errors": int((frames["intended_phase"] != frames["actual_phase"]).sum()),
+            "overwritten": max(0, self.count - len(self.frames)),
+        }
+
+    def save(self, fname):
+        """Write the frames as one compressed column per field (.npz)."""
+        frames = self.data()
+        np.savez_compressed(fname, frame_period=self.frame_period,
+                            **{name: frames[name] for name in FRAME_DTYPE.names})
+
+
+def load_frame_timing(fname):
+    """Read a file written by FrameTimer.save back into a structured array."""
+    with np.load(fname) as f:
+        frames = np.zeros(len(f["flip_time"]), dtype=FRAME_DTYPE)
+        for name in FRAME_DTYPE.names:
+            frames[name] = f[name]
+    return frames
@@ -0,0 +1,310 @@
+import json
+import queue
+import socket
+import struct
+import threading
+from time import time
+
+
+def encode_frame(data):
+    """Frame a dict as 4-byte length + JSON."""
+    event = json.dumps(data).encode("utf-8")
+    return struct.pack("!I", len(event)) + event
+
+
+def encode_event(event_id, timestamp, event_name, value):
+    """Frame one event the way the Kernel SDK expects: 4-byte length + JSON."""
+    return encode_frame({
+        "id": event_id,
+        "timestamp": timestamp,
+        "event": event_name,
+        "value": value,
+    })
+
+
+# Compact wire format. Frames keep the 4-byte length prefix; the first
+# payload byte tells them apart from JSON frames, which always start with "{".
+NAME_FRAME = 0x01  # kind, name index, UTF-8 name
+EVENT_FRAME = 0x02  # kind, id, timestamp (us), name index, value
+NAME_HEADER = struct.Struct("!BH")
+EVENT_STRUCT = struct.Struct("!BIqHi")
+_LENGTH = struct.Struct("!I")
+_INT32_MIN, _INT32_MAX = -(1 << 31), (1 << 31) - 1
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+_UINT32_MAX = (1 << 32) - 1
+_UINT16_MAX = (1 << 16) - 1
+
+
+class CompactEncoder:
+    """Encode events as fixed-size binary frames with interned event names.
+
+    Each name is sent once as a NAME_FRAME and referred to by index after
+    that. Values must be integers (or integer strings, as the stimulus
+    scripts send) that fit in int32; anything else, ids beyond uint32 and
+    names past the 65536th fall back to a JSON frame.
+
+    Parameters
+    ----------
+    names : list of str
+        Event names to intern up front, so they go out with the preamble.
+    """
+
+    def __init__(self, names=()):
+        self.names = {}
+        for name in names:
+            if len(self.names) > _UINT16_MAX:
+                break
+            self.names.setdefault(name, len(self.names))
+
+    def preamble(self):
+        """NAME_FRAMEs for every interned name; sent on each (re)connect."""
+        return b"".join(self._name_frame(name, index) for name, index in self.names.items())
+
+    def encode(self, event_id, timestamp, event_name, value):
+        try:
+            int_value = int(value)
+        except (TypeError, ValueError):
+            return encode_event(event_id, timestamp, event_name, value)
+        index = self.names.get(event_name)
+        if (not _INT32_MIN <= int_value <= _INT32_MAX or not 0 <= event_id <= _UINT32_MAX
+                or not _INT64_MIN <= timestamp <= _INT64_MAX or (index is None and len(self.names) > _UINT16_MAX)):
+            # Does not fit the fixed-size frame
+            return encode_event(event_id, timestamp, event_name, value)
+        frames = b""
+        if index is None:
+            index = self.names[event_name] = len(self.names)
+            frames = self._name_frame(event_name, index)
+        payload = EVENT_STRUCT.pack(EVENT_FRAME, event_id, timestamp, index, int_value)
+        return frames + _LENGTH.pack(len(payload)) + payload
+
+    @staticmethod
+    def _name_frame(name, index):
+        payload = NAME_HEADER.pack(NAME_FRAME, index) + name.encode("utf-8")
+        return _LENGTH.pack(len(payload)) + payload
+
+
+class EventDecoder:
+    """Incrementally decode a byte stream of JSON and compact frames.
+
+    feed() returns the events completed by the new bytes as dicts with the
+    same keys as the JSON protocol. Compact values are returned as strings.
+    """
+
+    def __init__(self):
+        self.names = {}
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        events = []
+        offset = 0
+        buffer = self._buffer
+        while len(buffer) - offset >= 4:
+            (size,) = _LENGTH.unpack_from(buffer, offset)
+            end = offset + 4 + size
+            if len(buffer) < end:
+                break
+            payload = bytes(buffer[offset + 4:end])
+            offset = end
+            if payload[:1] == b"{":
+                events.append(json.loads(payload))
+            elif payload[0] == NAME_FRAME:
+                _, index = NAME_HEADER.unpack_from(payload)
+                self.names[index] = payload[NAME_HEADER.size:].decode("utf-8")
+            elif payload[0] == EVENT_FRAME:
+                _, event_id, timestamp, index, value = EVENT_STRUCT.unpack(payload)
+                events.append({
+                    "id": event_id,
+                    "timestamp": timestamp,
+                    "event": self.names.get(index, str(index)),
+                    "value": str(value),
+                })
+        del buffer[:offset]
+        return events
+
+
+class EventSender:
+    """Send Kernel SDK events from a background thread.
+
+    send_event only timestamps the event and puts it on a bounded queue, so
+    the render thread never waits on the socket. The sender thread drains
+    whatever is queued, writes it with a single sendall, and if the Flow2 host
+    drops the connection it reconnects and replays the batch that failed.
+    Replayed events keep their id and timestamp, so duplicates are detectable
+    on the host side.
+
+    A reader thread drains whatever the host sends back; decoded frames are
+    passed to on_reply(frame, recv_us) if it is set (see clock_sync). Every
+    sent event is also kept in self.log as (id, timestamp, name, value).
+
+    Parameters
+    ----------
+    host : str
+        Flow2 acquisition machine.
+    port : int
+        Kernel SDK port.
+    maxsize : int
+        Queue capacity. When full, new events are dropped and counted in
+        self.dropped.
+    max_batch : int
+        Most events coalesced into one write.
+    timeout : float
+        Socket connect/send timeout in seconds.
+    retry_interval : float
+        Seconds between reconnect attempts.
+    encoding : str
+        'json' (what the Kernel SDK speaks) or 'compact' (CompactEncoder,
+        for the local stand-in server).
+    names : list of str
+        Event names to intern up front when encoding='compact'.
+    on_reply : callable | None
+        Called from the reader thread with each frame received from the host.
+    """
+
+    def __init__(self, host, port=6767, maxsize=4096, max_batch=256, timeout=5, retry_interval=1.0,
+                 encoding="json", names=(), on_reply=None):
+        if encoding not in ("json", "compact"):
+            raise ValueError(f"encoding must be 'json' or 'compact', got {encoding!r}")
+        self.encoder = CompactEncoder(names) if encoding == "compact" else None
+        self.host = host
+        self.port = port
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.on_reply = on_reply
+        self.event_id = 1
+        self.dropped = 0
+        self.log = []
+        self.sock = None
+        self._warned = False
+        self._peer_closed = False
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._pending = b""
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kernel-events", daemon=True)
+        self._thread.start()
+
+    def send_event(self, event_name, value):
+        """Queue an event and return its id. Never blocks."""
+        timestamp = int(time() * 1e6)
+        event_id = self.event_id
+        self.event_id += 1
+        self.log.append((event_id, timestamp, event_name, value))
+        try:
+            self._queue.put_nowait((event_id, timestamp, event_name, value))
+        except queue.Full:
+            # Counted only; close() reports it, off the render thread
+            self.dropped += 1
+        return event_id
+
+    def send_ping(self, seq):
+        """Queue a clock_ping. It is timestamped when the sender thread writes it,
+        not when queued, and uses id 0 so it does not consume an event id."""
+        try:
+            self._queue.put_nowait((0, None, "clock_ping", str(seq)))
+        except queue.Full:
+            pass
+
+    def save_log(self, fname):
+        """Write the sent events as JSON: a list of [id, timestamp, name, value]."""
+        with open(fname, "w") as f:
+            json.dump(self.log, f)
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def close(self, timeout=5):
+        """Flush queued events (up to timeout seconds) and close the socket.
+
+        Reports how many events were dropped because the queue was full.
+        """
+        self._stop.set()
+        self._thread.join(timeout)
+        self._disconnect()
+        if self.dropped:
+            print(f"Event queue was full: {self.dropped} events were dropped")
+
+    def _connect(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            if not self._warned:
+                print(f"TCP connection failed, retrying in the background: {e}")
+                self._warned = True
+            return False
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self._warned = False
+        self._peer_closed = False
+        threading.Thread(target=self._read, args=(sock,), name="kernel-events-reader", daemon=True).start()
+        if self.encoder is not None:
+            # A new connection has no name table; resend it ahead of any replay
+            self._pending = self.encoder.preamble() + self._pending
+        self._connected.set()
+        return True
+
+    def _disconnect(self):
+        self._connected.clear()
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _read(self, sock):
+        # Without a reader, a closed peer would go unnoticed and the next
+        # sendall would "succeed" into the void.
+        decoder = EventDecoder()
+        while True:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                data = b""
+            if not data:
+                if sock is self.sock:
+                    self._peer_closed = True
+                return
+            recv_us = int(time() * 1e6)
+            for frame in decoder.feed(data):
+                if self.on_reply is not None:
+                    self.on_reply(frame, recv_us)
+
+    def _next_batch(self):
+        try:
+            events = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return b""
+        while len(events) < self.max_batch:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        encode = encode_event if self.encoder is None else self.encoder.encode
+        now = int(time() * 1e6)
+        return b"".join(encode(event_id, now if timestamp is None else timestamp, name, value)
+                        for event_id, timestamp, name, value in events)
+
+    def _run(self):
+        while True:
+            if self.sock is None and not self._connect():
+                if self._stop.wait(self.retry_interval):
+                    return
+                continue
+            if not self._pending:
+                if self._stop.is_set() and self._queue.empty():
+                    return
+                self._pending = self._next_batch()
+                if not self._pending:
+                    continue
+            try:
+                if self._peer_closed:
+                    raise ConnectionResetError("peer closed the connection")
+                self.sock.sendall(self._pending)
+                self._pending = b""
+            except OSError as e:
+                print(f"Event connection lost, reconnecting: {e}")
+                self._disconnect()
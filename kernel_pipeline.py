@@ -0,0 +1,346 @@
+"""Kernel fNIRS pipeline: NaN repair -> optical density -> haemoglobin.
+
+The analysis scripts wrote the repaired intensities, read them back to
+compare, then wrote and re-opened every derivative for snirf.validateSnirf.
+run_pipeline keeps everything in memory instead: NaNs are repaired in place
+(with repair=True), optical density is computed in the same buffer, and each
+requested output is serialized to an in-memory HDF5 image, checked there
+with check_snirf, and written to disk once. The Raw passed in is modified.
+
+    outputs = run_pipeline(raw_intensity, {"od": "test_raw_od.snirf", "hb": "test_raw_hb.snirf"}, repair=True)
+
+Outputs can also be written with a different dataTimeSeries layout than
+write_raw_snirf's single contiguous float64 dataset: HDF5 chunks shaped for
+reading a few channels over long stretches of time, lossless gzip/lzf
+compression and an optional float32 payload (see write_validated).
+export_sessions runs the whole pipeline for several recordings in parallel
+processes.
+
+    export_sessions({"S001.snirf": {"hb": "S001_hb.snirf"}}, layout={"compression": "gzip", "dtype": "float32"})
+"""
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+from kernel_preprocessing import fill_nans, mark_nan_bads, nan_fractions
+
+REQUIRED_METADATA = ("SubjectID", "MeasurementDate", "MeasurementTime", "LengthUnit", "TimeUnit", "FrequencyUnit")
+PROCESSED_DATA_TYPE = 99999
+
+
+class SnirfValidationError(ValueError):
+    """Raised when an output fails check_snirf."""
+
+
+def _numbered(group, prefix):
+    return [group[k] for k in group if k.startswith(prefix) and k[len(prefix):].isdigit()]
+
+
+def check_snirf(f):
+    """Check an open h5py File against the required parts of the SNIRF spec.
+
+    Covers formatVersion, metadata tags, data/time shapes, the measurement
+    list (count, required fields and probe index ranges), the probe and the
+    stim groups. Returns a list of problems; empty means valid.
+    """
+    problems = []
+    if "formatVersion" not in f:
+        problems.append("/formatVersion is missing")
+    nirs_groups = [f[k] for k in f if k.startswith("nirs")]
+    if not nirs_groups:
+        return problems + ["no /nirs group"]
+    for nirs in nirs_groups:
+        where = nirs.name
+        meta = nirs.get("metaDataTags")
+        if meta is None:
+            problems.append(f"{where}/metaDataTags is missing")
+        else:
+            problems += [f"{where}/metaDataTags/{tag} is missing" for tag in REQUIRED_METADATA if tag not in meta]
+
+        probe = nirs.get("probe")
+        if probe is None:
+            problems.append(f"{where}/probe is missing")
+            n_src = n_det = n_wl = None
+        else:
+            if "wavelengths" not in probe:
+                problems.append(f"{where}/probe/wavelengths is missing")
+            n_wl = len(probe["wavelengths"]) if "wavelengths" in probe else None
+            pos = {}
+            for kind in ("source", "detector"):
+                key = next((k for k in (f"{kind}Pos3D", f"{kind}Pos2D") if k in probe), None)
+                if key is None:
+                    problems.append(f"{where}/probe/{kind}Pos2D or {kind}Pos3D is missing")
+                pos[kind] = len(probe[key]) if key else None
+            n_src, n_det = pos["source"], pos["detector"]
+
+        data_groups = _numbered(nirs, "data")
+        if not data_groups:
+            problems.append(f"{where}/data1 is missing")
+        for data in data_groups:
+            dwhere = data.name
+            if "dataTimeSeries" not in data or "time" not in data:
+                problems.append(f"{dwhere} needs dataTimeSeries and time")
+                continue
+            series, time = data["dataTimeSeries"], data["time"]
+            if series.ndim != 2:
+                problems.append(f"{dwhere}/dataTimeSeries must be 2D, got {series.shape}")
+                continue
+            n_times, n_channels = series.shape
+            if time.ndim != 1 or len(time) not in (n_times, 2):
+                problems.append(f"{dwhere}/time has {time.shape} entries for {n_times} samples")
+            lists = _numbered(data, "measurementList")
+            if len(lists) != n_channels:
+                problems.append(f"{dwhere} has {len(lists)} measurementList groups for {n_channels} channels")
+            for ml in lists:
+                missing = [k for k in ("sourceIndex", "detectorIndex", "wavelengthIndex", "dataType", "dataTypeIndex")
+                           if k not in ml]
+                if missing:
+                    problems.append(f"{ml.name} is missing {', '.join(missing)}")
+                    continue
+                if int(ml["dataType"][()]) == PROCESSED_DATA_TYPE and "dataTypeLabel" not in ml:
+                    problems.append(f"{ml.name} is processed data without dataTypeLabel")
+                for key, limit in (("sourceIndex", n_src), ("detectorIndex", n_det), ("wavelengthIndex", n_wl)):
+                    value = int(ml[key][()])
+                    if limit is not None and not 1 <= value <= limit:
+                        problems.append(f"{ml.name}/{key}={value} is outside 1..{limit}")
+
+        for stim in _numbered(nirs, "stim"):
+            if "name" not in stim or "data" not in stim:
+                problems.append(f"{stim.name} needs name and data")
+                continue
+            data = stim["data"]
+            if data.size and (data.ndim != 2 or data.shape[1] < 3):
+                problems.append(f"{stim.name}/data must be (n_events, >=3), got {data.shape}")
+            elif data.size and "dataLabels" in stim and len(stim["dataLabels"]) != data.shape[1]:
+                problems.append(f"{stim.name}/dataLabels has {len(stim['dataLabels'])} labels "
+                                f"for {data.shape[1]} columns")
+    return problems
+
+
+def repair_nans(raw, threshold=0.0, method="ffill"):
+    """Interpolate channels with NaNs, then fill what is left along time, in place.
+
+    Returns the channels that were marked bad and interpolated.
+    """
+    fractions = nan_fractions(raw._data)
+    bads = mark_nan_bads(raw, fractions, threshold)
+    if bads:
+        raw.interpolate_bads(reset_bads=True)
+    if np.isnan(raw._data).any():
+        left = fill_nans(raw._data, method)
+        if left:
+            raise ValueError(f"{left} NaNs remain after filling (channels that are entirely NaN)")
+    return bads
+
+
+def optical_density_inplace(raw):
+    """mne.preprocessing.nirs.optical_density without copying the data.
+
+    The intensity buffer of raw is overwritten with optical density.
+    """
+    from mne.io.constants import FIFF
+
+    picks = [i for i, t in enumerate(raw.get_channel_types()) if t == "fnirs_cw_amplitude"]
+    data = raw._data
+    if np.any(data[picks] <= 0):
+        # Same handling as MNE: abs(x), and no exact zeros
+        min_ = np.inf
+        for pi in picks:
+            np.abs(data[pi], out=data[pi])
+            min_ = min(min_, data[pi].min() or min_)
+        for pi in picks:
+            np.maximum(data[pi], min_, out=data[pi])
+    for pi in picks:
+        data[pi] /= data[pi].mean()
+        np.log(data[pi], out=data[pi])
+        data[pi] *= -1
+        raw.info["chs"][pi]["coil_type"] = FIFF.FIFFV_COIL_FNIRS_OD
+    return raw
+
+
+def snirf_chunks(n_times, n_channels, itemsize=8, channels_per_chunk=8, chunk_bytes=1 << 20):
+    """HDF5 chunk shape for dataTimeSeries that favours per-channel time access.
+
+    Each chunk holds channels_per_chunk channels and as many samples as fit
+    in chunk_bytes, so reading one channel's time course touches few chunks.
+    """
+    n_cols = max(1, min(n_channels, channels_per_chunk))
+    max_rows = max(1, min(n_times, chunk_bytes // (itemsize * n_cols)))
+    # Spread the samples evenly over the chunk rows so the last one isn't mostly empty
+    n_row_chunks = -(-n_times // max_rows)
+    return -(-n_times // n_row_chunks), n_cols
+
+
+def _copy_except(src, dst, skip):
+    for key, value in src.attrs.items():
+        dst.attrs[key] = value
+    for key, obj in src.items():
+        if obj.name in skip:
+            continue
+        if isinstance(obj, h5py.Group) and any(path.startswith(obj.name + "/") for path in skip):
+            _copy_except(obj, dst.create_group(key), skip)
+        else:
+            src.copy(obj, dst, name=key)
+
+
+def _write_layout(image, fname, data, chunks=True, compression=None, compression_opts=None, shuffle=None,
+                  dtype=None):
+    # Copy everything but dataTimeSeries from the in-memory image, then write
+    # the data in the requested layout, one chunk row at a time
+    series = "/nirs/data1/dataTimeSeries"
+    with h5py.File(image, "r") as src, h5py.File(fname, "w") as dst:
+        _copy_except(src, dst, {series})
+        n_times, n_channels = src[series].shape
+        dtype = np.dtype(dtype or src[series].dtype)
+        if chunks is True:
+            chunks = snirf_chunks(n_times, n_channels, dtype.itemsize)
+        if shuffle is None:
+            shuffle = compression is not None
+        out = dst.create_dataset(series, shape=(n_times, n_channels), dtype=dtype, chunks=chunks,
+                                 compression=compression, compression_opts=compression_opts, shuffle=shuffle)
+        step = chunks[0] if chunks else n_times
+        for start in range(0, n_times, step):
+            out[start:start + step] = data[:, start:start + step].T
+
+
+def compare_series(written, data, rtol=1e-6):
+    """Problems between a dataTimeSeries (n_times, n_channels) and the (n_channels, n_times) data.
+
+    NaN gaps are part of Kernel recordings, so their positions are compared
+    on their own and the values only where both are finite.
+    """
+    written = np.asarray(written).T
+    if written.shape != data.shape:
+        return [f"dataTimeSeries has shape {written.shape[::-1]}, expected {data.shape[::-1]}"]
+    problems = []
+    nan_written, nan_data = np.isnan(written), np.isnan(data)
+    if not np.array_equal(nan_written, nan_data):
+        problems.append(f"dataTimeSeries has NaNs in {int((nan_written != nan_data).sum())} other places")
+    finite = ~(nan_written | nan_data)
+    if not np.allclose(written[finite], data[finite], rtol=rtol, atol=0):
+        problems.append("dataTimeSeries does not match the data that was written")
+    return problems
+
+
+def write_validated(raw, fname, check_data=True, layout=None):
+    """Serialize raw to SNIRF in memory, check it, then write it to fname once.
+
+    Parameters
+    ----------
+    raw : mne.io.Raw
+    fname : str
+    check_data : bool
+        Also compare the serialized dataTimeSeries with raw's data (see
+        compare_series; NaN gaps must come back in the same places).
+    layout : dict | None
+        dataTimeSeries storage options; None keeps write_raw_snirf's
+        contiguous dataset. Keys: chunks (True for snirf_chunks, a shape, or
+        None), compression ('gzip', 'lzf' or None), compression_opts (gzip
+        level), shuffle (default on with compression) and dtype (e.g.
+        'float32'; the only lossy option).
+    """
+    from mne_nirs.io import write_raw_snirf
+
+    buffer = io.BytesIO()
+    write_raw_snirf(raw, buffer)
+    with h5py.File(buffer, "r") as f:
+        problems = check_snirf(f)
+        if check_data and not problems:
+            problems += compare_series(f["nirs/data1/dataTimeSeries"][()], raw._data)
+    if problems:
+        raise SnirfValidationError(f"{fname}: " + "; ".join(problems))
+    if layout:
+        _write_layout(buffer, fname, raw._data, **layout)
+    else:
+        with open(fname, "wb") as f:
+            f.write(buffer.getbuffer())
+    return fname
+
+
+def run_pipeline(raw, outputs, repair=False, nan_threshold=0.0, nan_method="ffill", ppf=6.0, layout=None):
+    """Optionally repair, then convert and write the requested stages of a Kernel recording.
+
+    Parameters
+    ----------
+    raw : mne.io.Raw
+        Preloaded intensity data. It is modified in place: NaN-repaired if
+        repair is set, and its data overwritten with optical density if
+        'od' or 'hb' is requested. Pass raw.copy() to keep the intensities.
+    outputs : dict
+        Stage ('intensity', 'od' or 'hb') -> SNIRF file to write.
+    repair : bool
+        Run repair_nans first (interpolate channels with NaNs, then fill
+        along time). Raises if an all-NaN channel cannot be repaired.
+    nan_threshold, nan_method
+        Passed to repair_nans.
+    ppf : float
+        Partial pathlength factor for the Beer-Lambert law.
+    layout : dict | None
+        dataTimeSeries storage options for every output, see write_validated.
+
+    Returns
+    -------
+    dict
+        Stage -> Raw for the stages that were computed ('od' is raw itself).
+    """
+    from mne.preprocessing.nirs import beer_lambert_law
+
+    unknown = set(outputs) - {"intensity", "od", "hb"}
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}")
+    results = {}
+    if repair:
+        repair_nans(raw, nan_threshold, nan_method)
+    if "intensity" in outputs:
+        write_validated(raw, outputs["intensity"], layout=layout)
+    if "od" in outputs or "hb" in outputs:
+        results["od"] = optical_density_inplace(raw)
+        if "od" in outputs:
+            write_validated(raw, outputs["od"], layout=layout)
+    if "hb" in outputs:
+        results["hb"] = beer_lambert_law(raw, ppf=ppf)
+        write_validated(results["hb"], outputs["hb"], layout=layout)
+    return results
+
+
+def _export_one(fname, outputs, scale, layout, kwargs):
+    from mne.io import read_raw_snirf
+
+    raw = read_raw_snirf(fname, preload=True, verbose=False)
+    if scale != 1:
+        raw._data *= scale
+    run_pipeline(raw, outputs, layout=layout, **kwargs)
+    return {stage: os.path.getsize(out) for stage, out in outputs.items()}
+
+
+def export_sessions(sessions, scale=1e-6, layout=None, n_jobs=None, **kwargs):
+    """Run the pipeline for several recordings in parallel processes.
+
+    Parameters
+    ----------
+    sessions : dict
+        Input SNIRF file -> outputs dict for run_pipeline.
+    scale : float
+        Applied to the intensities after reading (1e-6 for Kernel files).
+    layout : dict | None
+        Storage options for every output, see write_validated.
+    n_jobs : int | None
+        Worker processes (default: one per core). Each holds one recording.
+    **kwargs
+        Passed to run_pipeline (repair, nan_threshold, nan_method, ppf).
+
+    Returns
+    -------
+    dict
+        Input file -> {stage: bytes written}.
+
+    Call it from under ``if __name__ == "__main__":`` so worker processes
+    do not re-run the calling script.
+    """
+    with ProcessPoolExecutor(n_jobs) as pool:
+        futures = {fname: pool.submit(_export_one, fname, outputs, scale, layout, kwargs)
+                   for fname, outputs in sessions.items()}
+        return {fname: future.result() for fname, future in futures.items()}
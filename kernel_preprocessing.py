@@ -0,0 +1,89 @@
+"""NaN handling for Kernel Flow intensity data.
+
+Kernel recordings contain NaN gaps on some channels. nan_fractions counts
+them per channel in one reduction (or block by block from a SnirfReader),
+mark_nan_bads flags channels over a threshold, and fill_nans fills the
+remaining gaps along time in place, either by carrying the last valid value
+forward (then the first one back) or by linear interpolation. All of it
+works on the (n_channels, n_times) array directly, with no DataFrame copies.
+"""
+import numpy as np
+
+
+def nan_fractions(data):
+    """Fraction of NaN samples per channel.
+
+    data is an (n_channels, n_times) array or a kernel_snirf.SnirfReader,
+    which is read one block at a time.
+    """
+    if hasattr(data, "iter_blocks"):
+        counts = np.zeros(data.shape[0], dtype=np.int64)
+        for _, block in data.iter_blocks(dtype=np.float32):
+            counts += np.isnan(block).sum(axis=1)
+        return counts / data.shape[1]
+    return np.isnan(data).mean(axis=1)
+
+
+def mark_nan_bads(raw, fractions=None, threshold=0.0):
+    """Add channels whose NaN fraction exceeds threshold to raw.info['bads'].
+
+    threshold=0 marks any channel with a NaN. fNIRS channels are named
+    "S1_D1 760" and so on; when one wavelength of a source-detector pair is
+    over the threshold, the other wavelengths are marked too, since MNE
+    needs both bad to interpolate the pair. Returns the newly marked names.
+    """
+    if fractions is None:
+        fractions = nan_fractions(raw._data)
+    over = {ch.split(" ")[0] for ch, frac in zip(raw.ch_names, fractions) if frac > threshold}
+    new = [ch for ch in raw.ch_names if ch.split(" ")[0] in over and ch not in raw.info["bads"]]
+    raw.info["bads"].extend(new)
+    return new
+
+
+def _last_valid_index(valid):
+    # For every sample, index of the most recent valid sample (-1 if none yet)
+    idx = np.where(valid, np.arange(valid.shape[1]), -1)
+    return np.maximum.accumulate(idx, axis=1)
+
+
+def fill_nans(data, method="ffill"):
+    """Fill NaN gaps along the time axis of an (n_channels, n_times) array in place.
+
+    Parameters
+    ----------
+    data : ndarray, shape (n_channels, n_times)
+    method : 'ffill' | 'linear'
+        'ffill' carries the last valid value forward, then fills leading NaNs
+        with the first valid value (like DataFrame.ffill().bfill()). 'linear'
+        interpolates between the valid samples on either side of each gap,
+        with the same edge handling.
+
+    Returns
+    -------
+    int
+        NaNs left, i.e. samples of channels that are entirely NaN.
+    """
+    valid = ~np.isnan(data)
+    rows = np.flatnonzero(~valid.all(axis=1) & valid.any(axis=1))
+    if len(rows):
+        sub = data[rows]
+        ok = valid[rows]
+        n_times = sub.shape[1]
+        prev = _last_valid_index(ok)
+        nxt = n_times - 1 - _last_valid_index(ok[:, ::-1])[:, ::-1]
+        nxt[nxt == n_times] = -1
+        r = np.arange(len(rows))[:, None]
+        # Before the first valid sample use the next one, after the last use the previous one
+        prev_f = np.where(prev >= 0, prev, nxt)
+        next_f = np.where(nxt >= 0, nxt, prev_f)
+        if method == "ffill":
+            filled = sub[r, prev_f]
+        elif method == "linear":
+            t = np.arange(n_times)
+            span = np.where(next_f > prev_f, next_f - prev_f, 1)
+            w = np.clip((t - prev_f) / span, 0, 1)
+            filled = sub[r, prev_f] * (1 - w) + sub[r, next_f] * w
+        else:
+            raise ValueError(f"Unknown method {method!r}")
+        data[rows] = np.where(ok, sub, filled)
+    return int((~valid.any(axis=1)).sum() * data.shape[1])
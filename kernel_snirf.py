@@ -0,0 +1,339 @@
+"""Lazy reading of Kernel Flow SNIRF files.
+
+Kernel recordings have thousands of channels (8368 in a full Flow2 session),
+so read_raw_snirf(..., preload=True) followed by a unit-scaling
+apply_function holds the whole float64 matrix in memory, twice over.
+SnirfReader keeps the HDF5 file open and reads only the requested channels
+and samples of nirs/data1/dataTimeSeries, scaling them as they are read.
+iter_blocks walks the recording one HDF5 chunk row at a time.
+
+read_events collects every nirs/stim* group in one pass into a single
+time-sorted structured array (EVENT_DTYPE), maps stim group names to
+conditions with a regex table, and caches the result next to the file.
+Given a clock_sync.ClockModel and the stimulus PC's event log, it replaces
+the recorded onsets with clock-corrected send times.
+
+    with SnirfReader("Kernel_S001_2e8a8eb_5.snirf", scale=1e-6) as snirf:
+        block = snirf.get(["S1_D1 690", "S1_D1 850"], 0, 1000)
+"""
+import json
+import os
+import re
+import warnings
+from collections import namedtuple
+
+import h5py
+import numpy as np
+
+from clock_sync import match_onsets
+
+ChannelInfo = namedtuple("ChannelInfo", ["source", "detector", "wavelength", "data_type", "label"])
+ChannelInfo.__doc__ = """Per-channel measurement list (1-based source/detector/wavelength indices)."""
+
+
+def _read_str(value):
+    value = value[()] if isinstance(value, h5py.Dataset) else value
+    if isinstance(value, np.ndarray):
+        value = value.ravel()[0] if value.size else b""
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _numbered(group, prefix):
+    """Subgroups named <prefix><n>, in numeric order."""
+    pattern = re.compile(re.escape(prefix) + r"(\d*)$")
+    keys = [k for k in group if pattern.match(k)]
+    return [group[k] for k in sorted(keys, key=lambda k: int(pattern.match(k).group(1) or 0))]
+
+
+def read_measurement_list(data_group):
+    """ChannelInfo arrays for a nirs/data group.
+
+    Uses the vectorized measurementLists group (SNIRF 1.1) when present,
+    otherwise reads the measurementList<n> groups.
+    """
+    if "measurementLists" in data_group:
+        ml = data_group["measurementLists"]
+        n = len(ml["sourceIndex"])
+        labels = ml["dataTypeLabel"][()] if "dataTypeLabel" in ml else [b""] * n
+        return ChannelInfo(
+            ml["sourceIndex"][()].astype(int),
+            ml["detectorIndex"][()].astype(int),
+            ml["wavelengthIndex"][()].astype(int) if "wavelengthIndex" in ml else np.zeros(n, int),
+            ml["dataType"][()].astype(int),
+            np.array([_read_str(x) for x in labels]),
+        )
+    rows = []
+    for ml in _numbered(data_group, "measurementList"):
+        rows.append((
+            int(ml["sourceIndex"][()]),
+            int(ml["detectorIndex"][()]),
+            int(ml["wavelengthIndex"][()]) if "wavelengthIndex" in ml else 0,
+            int(ml["dataType"][()]),
+            _read_str(ml["dataTypeLabel"]) if "dataTypeLabel" in ml else "",
+        ))
+    columns = list(zip(*rows)) if rows else [[]] * 5
+    return ChannelInfo(*(np.array(c) for c in columns))
+
+
+class SnirfReader:
+    """Lazy, sliced access to one nirs/data block of a SNIRF file.
+
+    Parameters
+    ----------
+    fname : str
+    scale : float
+        Applied to every block as it is read (1e-6 for Kernel intensities,
+        as in the analysis scripts).
+    data : str
+        HDF5 path of the data group.
+    """
+
+    def __init__(self, fname, scale=1.0, data="nirs/data1"):
+        self.fname = fname
+        self.scale = scale
+        self._file = h5py.File(fname, "r")
+        group = self._file[data]
+        self.dataset = group["dataTimeSeries"]
+        self.channels = read_measurement_list(group)
+        time = group["time"][()].ravel()
+        if len(time) == 2 and self.dataset.shape[0] != 2:
+            # [start, interval] shorthand for evenly sampled data
+            self.sfreq = 1.0 / time[1]
+            self._time = None
+            self._t0 = time[0]
+        else:
+            self.sfreq = 1.0 / np.median(np.diff(time))
+            self._time = time
+            self._t0 = time[0]
+
+        probe = self._file["nirs/probe"]
+        self.wavelengths = probe["wavelengths"][()].ravel()
+        self.ch_names = self._channel_names(probe)
+        self._index = {name: i for i, name in enumerate(self.ch_names)}
+
+    def _channel_names(self, probe):
+        # Same convention as MNE: "S<src>_D<det> <wavelength>", or "... hbo"/"hbr"
+        names = []
+        for src, det, wl, label in zip(self.channels.source, self.channels.detector,
+                                       self.channels.wavelength, self.channels.label):
+            suffix = label.lower() if label else str(int(round(self.wavelengths[wl - 1])))
+            names.append(f"S{src}_D{det} {suffix}")
+        return names
+
+    @property
+    def shape(self):
+        """(n_channels, n_times), as MNE orders it."""
+        return self.dataset.shape[::-1]
+
+    @property
+    def n_times(self):
+        return self.dataset.shape[0]
+
+    @property
+    def times(self):
+        if self._time is not None:
+            return self._time
+        return self._t0 + np.arange(self.n_times) / self.sfreq
+
+    def pick(self, channels):
+        """Channel indices for a name, a list of names or indices, or None (all)."""
+        if channels is None:
+            return np.arange(len(self.ch_names))
+        if isinstance(channels, (str, int, np.integer)):
+            channels = [channels]
+        return np.array([self._index[ch] if isinstance(ch, str) else int(ch) for ch in channels])
+
+    def get(self, channels=None, start=0, stop=None, dtype=np.float64):
+        """Scaled (n_channels, n_samples) block for the given channels and samples.
+
+        Only the HDF5 chunks covering the selection are read.
+        """
+        idx = self.pick(channels)
+        stop = self.n_times if stop is None else min(stop, self.n_times)
+        if len(idx) == len(self.ch_names) and np.array_equal(idx, np.arange(len(idx))):
+            block = self.dataset[start:stop]
+        else:
+            # h5py needs increasing, unique indices; restore the requested order after
+            order, inverse = np.unique(idx, return_inverse=True)
+            block = self.dataset[start:stop, order][:, inverse]
+        block = block.T.astype(dtype)
+        if self.scale != 1:
+            block *= self.scale
+        return block
+
+    def iter_blocks(self, channels=None, n_samples=None, dtype=np.float64):
+        """Yield (start, block) over the whole recording, n_samples at a time.
+
+        The default block length follows the dataset's HDF5 chunking along
+        time, so each chunk is read once.
+        """
+        if n_samples is None:
+            chunks = self.dataset.chunks
+            n_samples = chunks[0] if chunks else max(1, (64 << 20) // (8 * max(1, self.dataset.shape[1])))
+        for start in range(0, self.n_times, n_samples):
+            yield start, self.get(channels, start, start + n_samples, dtype)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+EVENT_DTYPE = np.dtype([
+    ("timestamp", np.float64),
+    ("duration", np.float64),
+    ("value", np.float64),
+    ("group", "U64"),
+    ("block", np.int32),
+    ("block_label", "U64"),
+    ("condition", "U64"),
+])
+
+# (regex, condition) pairs tried in order with re.match; the condition may use
+# the pattern's groups, and None marks session markers that are not a
+# condition (condition ""). Unmatched stim groups keep their own name.
+DEFAULT_CONDITIONS = ((r"StartExperiment$", None), (r"Start(\w+)", r"\1"))
+
+# Bumped when EVENT_DTYPE changes, so older caches are re-read
+_CACHE_VERSION = 2
+
+_ONE_HOT_LABEL = re.compile(r"([^.]+)\.(.+)$")
+
+
+def map_conditions(names, table=DEFAULT_CONDITIONS):
+    """Condition for each stim group name; each distinct name is matched once."""
+    names = np.asarray(names)
+    unique, inverse = np.unique(names, return_inverse=True)
+    compiled = [(re.compile(pattern), condition) for pattern, condition in table]
+    mapped = []
+    for name in unique:
+        for regex, condition in compiled:
+            match = regex.match(name)
+            if match:
+                mapped.append("" if condition is None else match.expand(condition))
+                break
+        else:
+            mapped.append(name)
+    return np.array(mapped, dtype="U64")[inverse.ravel()]
+
+
+def _stim_events(stim):
+    data = np.atleast_2d(stim["data"][()]).astype(np.float64)
+    if data.size == 0:
+        return np.empty(0, dtype=EVENT_DTYPE)
+    events = np.zeros(len(data), dtype=EVENT_DTYPE)
+    events["timestamp"], events["duration"], events["value"] = data[:, 0], data[:, 1], data[:, 2]
+    events["group"] = _read_str(stim["name"])
+    events["block"] = -1
+    if "dataLabels" in stim and data.shape[1] > 3:
+        # Kernel one-hot block columns, e.g. BlankScreen.1 ... BlankScreen.10
+        labels = [_read_str(x) for x in stim["dataLabels"][()]]
+        cols, names, numbers = [], [], []
+        for col, label in enumerate(labels[3:], 3):
+            match = _ONE_HOT_LABEL.match(label)
+            if match:
+                cols.append(col)
+                names.append(label)
+                numbers.append(int(match.group(2)) if match.group(2).isdigit() else -1)
+        if cols:
+            hot = data[:, cols] == 1
+            first = hot.argmax(axis=1)
+            any_hot = hot.any(axis=1)
+            events["block"] = np.where(any_hot, np.array(numbers)[first], -1)
+            events["block_label"] = np.where(any_hot, np.array(names)[first], "")
+    return events
+
+
+def _signature(fname, conditions):
+    stat = os.stat(fname)
+    return json.dumps([_CACHE_VERSION, stat.st_size, stat.st_mtime_ns, [list(c) for c in conditions]])
+
+
+def read_events(fname, conditions=DEFAULT_CONDITIONS, cache=True, clock_model=None, event_log=None,
+                host_start_us=None, max_shift=0.5):
+    """All stim events of a SNIRF file as one structured array, sorted by time.
+
+    Parameters
+    ----------
+    fname : str
+    conditions : sequence of (regex, condition)
+        See DEFAULT_CONDITIONS, which maps StartBlankScreen to BlankScreen
+        and leaves the StartExperiment session marker without a condition.
+    cache : bool
+        Read from / write to <fname>.events.npz, which is reused while the
+        SNIRF file and the conditions table are unchanged.
+    clock_model : clock_sync.ClockModel | None
+        If given, onsets are replaced by the event_log send times mapped onto
+        the host clock (see clock_sync.match_onsets). The cache always holds
+        the onsets as recorded.
+    event_log : list | None
+        EventSender.log entries, e.g. json.load of the events_*.json file the
+        Kernel scripts save.
+    host_start_us : float | None
+        Recording start on the host clock, in microseconds.
+    max_shift : float
+        Largest distance in seconds between a recorded onset and its logged event.
+
+    Returns
+    -------
+    ndarray of EVENT_DTYPE
+        block is the number of the one-hot Kernel block column set for the
+        event (e.g. 3 for BlankScreen.3), or -1, and block_label that
+        column's label ("BlankScreen.3", or "" if none is set; non-numeric
+        suffixes are kept here). condition is "" for session markers.
+    """
+    events = _cached_events(fname, conditions, cache)
+    if clock_model is None:
+        return events
+    if event_log is None or host_start_us is None:
+        raise ValueError("clock_model needs event_log and host_start_us")
+    events = events.copy()
+    events["timestamp"], matched = match_onsets(events["timestamp"], events["group"], event_log,
+                                                clock_model, host_start_us, max_shift)
+    if not matched.all():
+        warnings.warn(f"{fname}: {(~matched).sum()} of {len(events)} events have no logged "
+                      f"counterpart and were left unaligned")
+    return events[np.argsort(events["timestamp"], kind="stable")]
+
+
+def _cached_events(fname, conditions, cache):
+    cache_file = fname + ".events.npz"
+    signature = _signature(fname, conditions)
+    if cache and os.path.exists(cache_file):
+        with np.load(cache_file) as f:
+            if str(f["signature"]) == signature:
+                return f["events"]
+
+    with h5py.File(fname, "r") as f:
+        parts = [_stim_events(stim) for stim in _numbered(f["nirs"], "stim")]
+    events = np.concatenate(parts) if parts else np.empty(0, dtype=EVENT_DTYPE)
+    events = events[np.argsort(events["timestamp"], kind="stable")]
+    events["condition"] = map_conditions(events["group"], conditions) if len(events) else []
+    if cache:
+        np.savez(cache_file, events=events, signature=np.array(signature))
+    return events
+
+
+def events_to_mne(events, sfreq, event_id=None, first_samp=0):
+    """MNE (n_events, 3) array and event_id from read_events output.
+
+    event_id maps conditions to codes; by default every condition present is
+    numbered from 1 in sorted order (BlankScreen=1, Checkerboard=2 with
+    DEFAULT_CONDITIONS). Session markers (condition "") and events whose
+    condition is not in event_id are left out.
+    """
+    if event_id is None:
+        present = np.unique(events["condition"])
+        event_id = {c: i for i, c in enumerate(present[present != ""].tolist(), 1)}
+    conditions = np.array(list(event_id), dtype="U64")
+    codes = np.array(list(event_id.values()))
+    order = np.argsort(conditions)
+    selected = events[np.isin(events["condition"], conditions)]
+    out = np.zeros((len(selected), 3), dtype=int)
+    out[:, 0] = np.round(selected["timestamp"] * sfreq).astype(int) + first_samp
+    out[:, 2] = codes[order[np.searchsorted(conditions, selected["condition"], sorter=order)]]
+    return out, event_id
@@ -0,0 +1,173 @@
+"""Local stand-in for the Kernel SDK event server on the Flow2 machine.
+
+Accepts the JSON and compact event protocols from kernel_events on port 6767
+and records, per event, how long it took from the sender's timestamp to
+arrival here. clock_ping events are answered with a clock_pong carrying this
+host's receive and send times (see clock_sync); the host clock can be given
+an artificial offset and drift to exercise the estimator. Run it directly to
+benchmark the event path:
+
+    python kernel_stand_in.py                 # serve until Ctrl-C
+    python kernel_stand_in.py --bench 100000  # send events through it and report
+"""
+import argparse
+import socketserver
+import threading
+from time import perf_counter, sleep, time
+
+import numpy as np
+
+from kernel_events import EventDecoder, EventSender, encode_frame
+
+# Latency histogram edges in microseconds, log-spaced from 1 us to 10 s
+LATENCY_EDGES_US = np.logspace(0, 7, 71)
+
+
+class LatencyRecorder:
+    """Thread-safe receive-latency histogram and event counter."""
+
+    def __init__(self, edges=LATENCY_EDGES_US):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) + 1, dtype=np.int64)
+        self.n_events = 0
+        self.first_recv = None
+        self.last_recv = None
+        self._lock = threading.Lock()
+
+    def add(self, recv_us, timestamps_us):
+        latencies = recv_us - np.asarray(timestamps_us, dtype=np.int64)
+        bins = np.searchsorted(self.edges, latencies, side="right")
+        with self._lock:
+            np.add.at(self.counts, bins, 1)
+            self.n_events += len(latencies)
+            if self.first_recv is None:
+                self.first_recv = recv_us
+            self.last_recv = recv_us
+
+    def quantile(self, q):
+        """Upper bin edge (us) below which a fraction q of latencies fall."""
+        if self.n_events == 0:
+            return float("nan")
+        index = np.searchsorted(np.cumsum(self.counts), q * self.n_events)
+        return float(self.edges[min(index, len(self.edges) - 1)])
+
+    def summary(self):
+        elapsed = (self.last_recv - self.first_recv) / 1e6 if self.n_events > 1 else 0.0
+        return {
+            "events": self.n_events,
+            "events_per_s": self.n_events / elapsed if elapsed > 0 else float("nan"),
+            "p50_us": self.quantile(0.5),
+            "p99_us": self.quantile(0.99),
+            "p999_us": self.quantile(0.999),
+        }
+
+
+class _EventHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        decoder = EventDecoder()
+        server = self.server
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            recv_us = int(time() * 1e6)
+            host_recv_us = server.host_time(recv_us)
+            events = decoder.feed(data)
+            for e in events:
+                if e["event"] == "clock_ping":
+                    self.request.sendall(encode_frame({
+                        "event": "clock_pong",
+                        "value": e["value"],
+                        "t0": e["timestamp"],
+                        "t1": host_recv_us,
+                        "t2": server.host_time(int(time() * 1e6)),
+                    }))
+            if events:
+                server.recorder.add(recv_us, [e["timestamp"] for e in events])
+                if server.keep_events:
+                    with server.lock:
+                        server.events.extend(events)
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """Kernel SDK stand-in. Use as a context manager or call serve_forever().
+
+    Parameters
+    ----------
+    host, port : str, int
+        Address to listen on. Port 0 picks a free port (see server_address).
+    keep_events : bool
+        Keep every decoded event in self.events.
+    clock_offset_us, clock_drift : float
+        Simulated host clock: local * (1 + clock_drift) + clock_offset_us.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=6767, keep_events=False, clock_offset_us=0.0, clock_drift=0.0):
+        super().__init__((host, port), _EventHandler)
+        self.clock_offset_us = clock_offset_us
+        self.clock_drift = clock_drift
+        self.recorder = LatencyRecorder()
+        self.keep_events = keep_events
+        self.events = []
+        self.lock = threading.Lock()
+
+    def host_time(self, local_us):
+        return int(local_us * (1 + self.clock_drift) + self.clock_offset_us)
+
+    def start(self):
+        """Serve from a daemon thread and return self."""
+        threading.Thread(target=self.serve_forever, name="kernel-stand-in", daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        super().__exit__(*args)
+
+
+def benchmark(n_events=100_000, encoding="json"):
+    """Push n_events through EventSender into a fresh stand-in server."""
+    with StandInServer(port=0).start() as server:
+        host, port = server.server_address
+        sender = EventSender(host, port, maxsize=n_events + 1, encoding=encoding)
+        sender.wait_connected(5)
+        t0 = perf_counter()
+        for i in range(n_events):
+            sender.send_event("checkerboard_start", str(i % 10))
+        enqueue_s = perf_counter() - t0
+        sender.close(timeout=60)
+        while server.recorder.n_events < n_events and perf_counter() - t0 < 60:
+            sleep(0.01)
+        result = server.recorder.summary()
+    result["encoding"] = encoding
+    result["enqueue_us_per_event"] = enqueue_s / n_events * 1e6
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6767)
+    parser.add_argument("--bench", type=int, metavar="N", help="benchmark both encodings with N events")
+    args = parser.parse_args()
+
+    if args.bench:
+        for encoding in ("json", "compact"):
+            print(benchmark(args.bench, encoding))
+        return
+
+    server = StandInServer(args.host, args.port)
+    print(f"Listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.recorder.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,28 @@
-from psychopy import visual, core, event
-import json
-import socket
-import struct
-from time import time
+from psychopy import visual, core
+from checkerboard import CheckerboardStim
+from kernel_events import EventSender
+from clock_sync import ClockSync
+from frame_timing import FrameTimer
+from paradigm import BLANK, FIXATION, CHECKERBOARD, Block, Marker, KernelMarkers, compile_timeline, run_timeline
+from startup import prewarm, time_to_first_frame
+from datetime import datetime
+
+t_start = core.getTime()
 
 # Set up window
 win = visual.Window(size=(2560, 1440), fullscr=True, monitor='display_stimuli', screen=1, units='pix')
 win.color = "black"
 
-# One-time connection
+# One-time connection; events are sent from a background thread
 host = 'magical-mcclintock'
 port = 6767
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sock.connect((host, port))
-
-# Function to send events
-def send_event(sock, id, event_name, value):
-    timestamp = time()
-    data_to_send = {
-        "id": id,
-        "timestamp": int(timestamp * 1e6),
-        "event": event_name,
-        "value": value,
-    }
-    event = json.dumps(data_to_send).encode("utf-8")
-    msg = struct.pack("!I", len(event)) + event
-    sock.sendall(msg)
-
-# Initialize event ID
-event_id = 1
+sender = EventSender(host, port)
+if not sender.wait_connected(5):
+    print("TCP connection not established yet; events will be queued until it is.")
 
-# Send start_experiment event
-send_event(sock, event_id, "start_experiment", "0")
-event_id += 1
+# Clock offset/drift pings; only enable when the host answers clock_ping (e.g. kernel_stand_in.py)
+sync_clocks = False
+clock = ClockSync(sender).start() if sync_clocks else None
 
 # Parameters
 check_size = 20  # Size of each square in pixels
@@ -41,73 +31,50 @@ duration = 2     # Duration of the experiment (seconds)
 fixation_size = 30
 lineWidth = 15
 
-# Send initial events and wait before paradigm starts
-core.wait(5)
-send_event(sock, event_id, "initial_event", "5")
-event_id += 1
-
-# Create checkerboard stimulus
+# Create checkerboard stimulus (all phase states are built once here, arrays cached on disk)
 num_squares = 260
-colors = [[-1, 1] if (x + y) % 2 == 0 else [1, -1]
-          for x in range(num_squares) for y in range(num_squares)]
-checkerboard = visual.ElementArrayStim(win, nElements=num_squares**2, sizes=(check_size, check_size),
-                                       xys=[((x - num_squares // 2) * check_size, (y - num_squares // 2) * check_size)
-                                            for x in range(num_squares) for y in range(num_squares)],
-                                       elementTex=None, elementMask=None, colors=colors, colorSpace='rgb')
+checkerboard = CheckerboardStim(win, num_squares=num_squares, check_size=check_size, check_freq=check_freq, n_phases=4)
 
 # Create fixation point stimulus
 fixation_vertical = visual.Line(win, start=(0, -fixation_size), end=(0, fixation_size), lineColor="red", lineWidth=lineWidth)
 fixation_horizontal = visual.Line(win, start=(-fixation_size, 0), end=(fixation_size, 0), lineColor="red", lineWidth=lineWidth)
+fixation = [fixation_vertical, fixation_horizontal]
 
-# Main loop
-win.flip()
-print("start")
-print(core.getTime()) 
+# Warm up stimuli and wait for steady flips before the first marker
+startup = prewarm(win, checkerboard, fixation)
+print(startup)
+frame_rate = round(1 / startup["frame_period"])
 
+# Paradigm: 5 s wait, then 10 x (10 x 1 s fixation, 10 x checkerboard), then 5 x 1 s fixation
+blocks = [Block(BLANK, 5, start=Marker("start_experiment", "0"), end=Marker("initial_event", "5"))]
 for n in range(10):
-    for i in range(10):
-        fixation_vertical.draw()
-        fixation_horizontal.draw()
-        win.flip()
-        send_event(sock, event_id, "fixation_shown", "1")
-        event_id += 1
-        core.wait(1)
-    for i in range(10):
-        start_time = core.getTime()
-        send_event(sock, event_id, "checkerboard_start", str(i))
-        event_id += 1
-        while core.getTime() - start_time < duration:
-            t = core.getTime() - start_time
-            phase = int(t * check_freq) % 4
-            colors = [[-1, -1, -1] if (x + y + phase) % 2 == 0 else [1, 1, 1]
-                      for x in range(num_squares) for y in range(num_squares)]
-            checkerboard.colors = colors
-            checkerboard.draw()
-            fixation_vertical.draw()
-            fixation_horizontal.draw()
-            win.flip()
-        send_event(sock, event_id, "checkerboard_end", str(i))
-        event_id += 1
-        for keys in event.getKeys():
-            if 'escape' in keys:
-                send_event(sock, event_id, "experiment_abort", "0")
-                win.close()
-                core.quit()
+    blocks += [Block(FIXATION, 1, start=Marker("fixation_shown", "1"))] * 10
+    blocks += [Block(CHECKERBOARD, duration, start=Marker("checkerboard_start", str(i)),
+                     end=Marker("checkerboard_end", str(i)), check_keys=True) for i in range(10)]
+blocks += [Block(FIXATION, 1, start=Marker("final_fixation", "1"))] * 5
+blocks += [Block(BLANK, 0, start=Marker("end_experiment", "0"))]
+timeline = compile_timeline(blocks, frame_rate, check_freq, n_phases=4)
 
-for i in range(5):
-    fixation_vertical.draw()
-    fixation_horizontal.draw()
-    win.flip()
-    send_event(sock, event_id, "final_fixation", "1")
-    event_id += 1
-    core.wait(1)
+# Flip timing for every frame
+timer = FrameTimer(frame_period=1 / frame_rate)
 
-# Send end_experiment event
-send_event(sock, event_id, "end_experiment", "0")
+# Main loop
+print("start")
+print(core.getTime())
+run_timeline(win, timeline, checkerboard, fixation, KernelMarkers(sender),
+             timer=timer, abort=Marker("experiment_abort", "0"))
 
 # Clean up
 print("end")
 print(core.getTime())
+print(f"time to first frame: {time_to_first_frame(timer, t_start):.3f} s")
+print(timer.summary())
+stamp = f"{datetime.now():%Y-%m-%d_%H-%M-%S}"
+timer.save(f"frame_timing_{stamp}.npz")
+if clock is not None:
+    clock.stop()
+    clock.save(f"clock_sync_{stamp}.npy")
+sender.close()
+sender.save_log(f"events_{stamp}.json")
 win.close()
 core.quit()
-sock.close()
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""Block-design paradigms compiled ahead of time into a frame-indexed timeline.
+
+A paradigm is a list of Blocks (what is on screen, for how long, and which
+markers go out at its start and end). compile_timeline turns that into flat
+per-frame arrays, so run_timeline only looks things up by frame index:
+draw the state for this frame, flip, send the markers due after this flip.
+
+Markers are sent through a backend: KernelMarkers (TCP, via EventSender),
+LslMarkers (pylsl StreamOutlet) or NoMarkers.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from checkerboard import phase_count
+
+# Draw states. Checkerboard frames are CHECKERBOARD + phase.
+BLANK = 0
+FIXATION = 1
+CHECKERBOARD = 2
+
+Marker = namedtuple("Marker", ["name", "value", "code"], defaults=(None, None))
+Marker.__doc__ = """Event sent through a marker backend.
+
+name/value are what the Kernel SDK receives; code is the LSL sample value."""
+
+Block = namedtuple("Block", ["state", "duration", "start", "end", "check_keys"],
+                   defaults=((), (), False))
+Block.__doc__ = """One block of a paradigm.
+
+state is BLANK, FIXATION or CHECKERBOARD, duration is in seconds, start/end
+are a Marker or a tuple of Markers sent right after the block's first flip
+and right after it ends. check_keys polls for escape at the end of the block."""
+
+
+def _markers(markers):
+    if isinstance(markers, Marker):
+        return (markers,)
+    return tuple(markers)
+
+
+class Timeline:
+    """Compiled paradigm; see compile_timeline.
+
+    Attributes
+    ----------
+    frame_rate : float
+        Refresh rate the timeline was compiled for.
+    states : ndarray, shape (n_frames,)
+        Draw state of each frame.
+    blocks : ndarray, shape (n_frames,)
+        Block index of each frame.
+    block_starts : ndarray, shape (n_blocks + 1,)
+        First frame of each block; the last entry is n_frames.
+    block_events : ndarray, shape (n_blocks,)
+        Index in events of each block's first start marker, -1 if none.
+    events : list of Marker
+        All markers in send order.
+    end_blocks : ndarray, shape (n_events,)
+        Block whose end each marker marks, -1 for start markers.
+    event_offsets : ndarray, shape (n_frames + 2,)
+        events[event_offsets[f]:event_offsets[f + 1]] are sent after flip f;
+        frame n_frames holds the markers sent after the last flip.
+    check_keys : ndarray of bool, shape (n_frames,)
+        Poll for escape after this frame (the last frame of a check_keys block).
+    """
+
+    def __init__(self, frame_rate, states, blocks, block_starts, block_events, events, end_blocks,
+                 event_offsets, check_keys):
+        self.frame_rate = frame_rate
+        self.states = states
+        self.blocks = blocks
+        self.block_starts = block_starts
+        self.block_events = block_events
+        self.events = events
+        self.end_blocks = end_blocks
+        self.event_offsets = event_offsets
+        self.check_keys = check_keys
+
+    @property
+    def n_frames(self):
+        return len(self.states)
+
+    @property
+    def duration(self):
+        return self.n_frames / self.frame_rate
+
+    def events_at(self, frame):
+        return self.events[self.event_offsets[frame]:self.event_offsets[frame + 1]]
+
+    def block_end_events(self, block):
+        """Indices in events of the end markers of a block."""
+        stop = self.block_starts[block + 1]
+        idx = np.arange(self.event_offsets[stop], self.event_offsets[stop + 1])
+        return idx[self.end_blocks[idx] == block]
+
+
+def compile_timeline(blocks, frame_rate, check_freq=1, n_phases=None):
+    """Compile a list of Blocks into a Timeline.
+
+    Block durations are rounded to whole frames. Checkerboard phase k of a
+    block is int(k / frame_rate * check_freq) % n_phases, as in the old
+    time-based loops.
+    """
+    n_phases = n_phases or phase_count(check_freq)
+    n_block_frames = np.array([int(round(b.duration * frame_rate)) for b in blocks], dtype=np.int64)
+    block_starts = np.concatenate([[0], np.cumsum(n_block_frames)])
+    n_frames = int(block_starts[-1])
+
+    states = np.empty(n_frames, dtype=np.int8)
+    block_index = np.repeat(np.arange(len(blocks), dtype=np.int32), n_block_frames)
+    check_keys = np.zeros(n_frames, dtype=bool)
+    event_frames = []
+    event_blocks = []
+    end_blocks = []
+    events = []
+    for i, b in enumerate(blocks):
+        first, stop = block_starts[i], block_starts[i + 1]
+        if b.state == CHECKERBOARD:
+            k = np.arange(stop - first)
+            states[first:stop] = CHECKERBOARD + np.floor(k * check_freq / frame_rate).astype(np.int64) % n_phases
+        else:
+            states[first:stop] = b.state
+        for marker in _markers(b.start):
+            event_frames.append(first)
+            event_blocks.append(i)
+            end_blocks.append(-1)
+            events.append(marker)
+        for marker in _markers(b.end):
+            event_frames.append(stop)
+            event_blocks.append(-1)
+            end_blocks.append(i)
+            events.append(marker)
+        if b.check_keys and stop > first:
+            check_keys[stop - 1] = True
+
+    # Stable sort keeps the block order of markers that share a frame
+    order = np.argsort(np.array(event_frames, dtype=np.int64), kind="stable")
+    events = [events[i] for i in order]
+    end_blocks = np.asarray(end_blocks, dtype=np.int64)[order]
+    event_frames = np.asarray(event_frames, dtype=np.int64)[order]
+    event_offsets = np.searchsorted(event_frames, np.arange(n_frames + 2), side="left")
+    block_events = np.full(len(blocks), -1, dtype=np.int64)
+    for j, i in enumerate(order):
+        if event_blocks[i] >= 0 and block_events[event_blocks[i]] == -1:
+            block_events[event_blocks[i]] = j
+    return Timeline(frame_rate, states, block_index, block_starts, block_events, events, end_blocks,
+                    event_offsets, check_keys)
+
+
+class KernelMarkers:
+    """Send markers as Kernel SDK events through an EventSender."""
+
+    def __init__(self, sender):
+        self.sender = sender
+
+    def send(self, marker):
+        return self.sender.send_event(marker.name, marker.value)
+
+
+class LslMarkers:
+    """Push marker codes to a pylsl StreamOutlet."""
+
+    def __init__(self, outlet):
+        self.outlet = outlet
+
+    def send(self, marker):
+        self.outlet.push_sample([marker.code])
+        return marker.code
+
+
+class NoMarkers:
+    def send(self, marker):
+        return -1
+
+
+def run_timeline(win, timeline, checkerboard, fixation, markers, timer=None, abort=None):
+    """Present a compiled timeline, one flip per frame.
+
+    Parameters
+    ----------
+    win : psychopy.visual.Window
+    timeline : Timeline
+    checkerboard : CheckerboardStim
+    fixation : list of stimuli
+        Drawn on FIXATION and CHECKERBOARD frames.
+    markers : KernelMarkers | LslMarkers | NoMarkers
+    timer : FrameTimer | None
+        Records every flip; phases are -1 outside checkerboard blocks.
+    abort : Marker | tuple of Marker
+        Sent if escape is pressed at a check_keys frame, after the end
+        markers of the block being aborted so its start is always closed.
+
+    Returns
+    -------
+    bool
+        False if the run was aborted with escape.
+    """
+    from psychopy import event
+
+    states = timeline.states
+    blocks = timeline.blocks
+    block_starts = timeline.block_starts
+    block_events = timeline.block_events
+    offsets = timeline.event_offsets
+    events = timeline.events
+    check_keys = timeline.check_keys
+    block_t0 = 0.0
+
+    for frame in range(timeline.n_frames):
+        state = states[frame]
+        if state >= CHECKERBOARD:
+            checkerboard.draw_phase(state - CHECKERBOARD)
+        if state >= FIXATION:
+            for stim in fixation:
+                stim.draw()
+        flip_time = win.flip()
+
+        block = blocks[frame]
+        event_id = -1
+        for i in range(offsets[frame], offsets[frame + 1]):
+            sent = markers.send(events[i])
+            if i == block_events[block]:
+                event_id = sent
+        if timer is not None:
+            if frame == block_starts[block]:
+                block_t0 = flip_time
+                timer.start_block(block, event_id)
+            if state >= CHECKERBOARD:
+                timer.record(flip_time, checkerboard.phase_at(flip_time - block_t0), state - CHECKERBOARD)
+            else:
+                timer.record(flip_time, -1, -1)
+        if check_keys[frame] and 'escape' in event.getKeys():
+            for i in timeline.block_end_events(block):
+                markers.send(events[i])
+            for marker in _markers(abort or ()):
+                markers.send(marker)
+            return False
+
+    for i in range(offsets[timeline.n_frames], offsets[timeline.n_frames + 1]):
+        markers.send(events[i])
+    return True
@@ -0,0 +1,70 @@
+"""Startup phase for the stimulus scripts.
+
+prewarm draws every stimulus state once into the back buffer (then clears
+it, so nothing is shown), waits for the GPU to finish, and then flips blank
+frames until the flip interval is steady. Run it after the window and
+stimuli are built and before the first marker goes out, so none of this
+shifts the baseline.
+"""
+from time import perf_counter
+
+import numpy as np
+
+
+def prewarm(win, checkerboard, fixation, n_stable=10, tolerance=0.25, max_wait=5.0):
+    """Warm up the stimuli and wait for a steady frame rate.
+
+    Parameters
+    ----------
+    win : psychopy.visual.Window
+    checkerboard : CheckerboardStim
+    fixation : list of stimuli
+    n_stable : int
+        Consecutive flips that must land within tolerance of the frame period.
+    tolerance : float
+        Allowed deviation from the frame period, as a fraction of it.
+    max_wait : float
+        Give up waiting for steady flips after this many seconds.
+
+    Returns
+    -------
+    dict
+        warmup_s (draw + glFinish), settle_s (blank flips), ready (whether
+        n_stable steady flips were seen) and frame_period (median interval).
+    """
+    from pyglet import gl
+
+    t0 = perf_counter()
+    for phase in range(checkerboard.n_phases):
+        checkerboard.draw_phase(phase)
+    for stim in fixation:
+        stim.draw()
+    gl.glFinish()
+    win.clearBuffer()
+    warmup_s = perf_counter() - t0
+
+    t0 = perf_counter()
+    flips = [win.flip()]
+    stable = 0
+    while stable < n_stable and perf_counter() - t0 < max_wait:
+        flips.append(win.flip())
+        if len(flips) < 3:
+            continue
+        intervals = np.diff(flips[-(n_stable + 1):])
+        period = np.median(intervals)
+        stable = stable + 1 if abs(intervals[-1] - period) <= tolerance * period else 0
+    intervals = np.diff(flips)
+    return {
+        "warmup_s": warmup_s,
+        "settle_s": perf_counter() - t0,
+        "ready": stable >= n_stable,
+        "frame_period": float(np.median(intervals)) if len(intervals) else float("nan"),
+    }
+
+
+def time_to_first_frame(timer, t_start):
+    """Seconds from t_start (core.getTime() at script start) to the first recorded flip."""
+    frames = timer.data()
+    if len(frames) == 0:
+        return float("nan")
+    return float(frames["flip_time"][0] - t_start)